@@ -0,0 +1,5 @@
+# Every benchmark client acts as the one seeded benchmark user, whose token bucket would turn most
+# of the load into fast 429s. Admission is off unless ADMISSION_ENABLED is set, before src reads its settings.
+import os
+
+os.environ.setdefault("ADMISSION_ENABLED", "false")
@@ -0,0 +1,99 @@
+# Minimal in-process ASGI client used by the benchmarks, no extra http library required
+
+import json
+import time
+from typing import Dict, Optional
+from urllib.parse import urlencode
+
+
+class Response:
+    """ Response returned by the ASGI client """
+
+    def __init__(self, status_code: int, headers: Dict[str, str], body: bytes, elapsed: float):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.elapsed = elapsed
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class AsgiClient:
+    """ This class drives an ASGI application directly inside the running event loop """
+
+    def __init__(self, app, headers: Optional[Dict[str, str]] = None):
+        self.app = app
+        self.headers = headers or {}
+
+    async def request(self, method: str, path: str, params: dict = None, headers: dict = None,
+                      json_body=None, form: dict = None) -> Response:
+        """send one request through the app and collect the full response"""
+        all_headers = {**self.headers, **(headers or {})}
+        body = b""
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            all_headers["content-type"] = "application/json"
+        elif form is not None:
+            body = urlencode(form).encode()
+            all_headers["content-type"] = "application/x-www-form-urlencoded"
+        all_headers["content-length"] = str(len(body))
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": urlencode(params or {}, doseq=True).encode(),
+            "headers": [(k.lower().encode(), str(v).encode()) for k, v in all_headers.items()],
+            "client": ("benchmark", 0),
+            "server": ("benchmark", 80),
+        }
+        request_sent = False
+        status_code = 500
+        response_headers = {}
+        chunks = []
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status_code, response_headers
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                response_headers = {k.decode(): v.decode() for k, v in message.get("headers", [])}
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        started = time.perf_counter()
+        await self.app(scope, receive, send)
+        return Response(status_code, response_headers, b"".join(chunks), time.perf_counter() - started)
+
+    async def get(self, path: str, **kwargs) -> Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> Response:
+        return await self.request("POST", path, **kwargs)
+
+    async def put(self, path: str, **kwargs) -> Response:
+        return await self.request("PUT", path, **kwargs)
+
+    async def delete(self, path: str, **kwargs) -> Response:
+        return await self.request("DELETE", path, **kwargs)
+
+
+def percentile(samples, pct: float) -> float:
+    """nearest-rank percentile of the given samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
@@ -0,0 +1,43 @@
+# Compare two load test reports of benchmarks.load_test
+#
+# usage: python3 -m benchmarks.compare base.json new.json --threshold 10
+#
+# Exits with status 1 when a route lost more than threshold percent of throughput
+# or its p99 latency grew by more than threshold percent.
+
+import argparse
+import json
+import sys
+
+
+def change(base: float, new: float) -> float:
+    """relative change in percent"""
+    return (new - base) / base * 100 if base else 0.0
+
+
+def compare(base: dict, new: dict, threshold: float):
+    """rows of (route, metric, base, new, change, regressed) for the routes of both reports"""
+    rows = []
+    for route in sorted(set(base["routes"]) & set(new["routes"])):
+        for metric, higher_is_better in (("throughput_rps", True), ("p50_ms", False), ("p95_ms", False), ("p99_ms", False)):
+            old_value, new_value = base["routes"][route][metric], new["routes"][route][metric]
+            delta = change(old_value, new_value)
+            regressed = metric in ("throughput_rps", "p99_ms") and (-delta if higher_is_better else delta) > threshold
+            rows.append((route, metric, old_value, new_value, round(delta, 1), regressed))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="compare two load test reports")
+    parser.add_argument("base", help="report of the reference commit")
+    parser.add_argument("new", help="report of the commit under test")
+    parser.add_argument("--threshold", type=float, default=10.0, help="tolerated regression in percent")
+    args = parser.parse_args()
+
+    with open(args.base) as base_file, open(args.new) as new_file:
+        rows = compare(json.load(base_file), json.load(new_file), args.threshold)
+
+    print(f"{'route':>8} {'metric':>15} {'base':>10} {'new':>10} {'change':>8}")
+    for route, metric, old_value, new_value, delta, regressed in rows:
+        print(f"{route:>8} {metric:>15} {old_value:>10} {new_value:>10} {delta:>7}%{'  REGRESSION' if regressed else ''}")
+    sys.exit(1 if any(row[-1] for row in rows) else 0)
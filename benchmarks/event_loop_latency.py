@@ -0,0 +1,85 @@
+# Benchmark: task listing latency and event loop responsiveness as concurrent clients grow
+#
+# usage: python3 -m benchmarks.event_loop_latency --levels 1,8,32,128 --requests 50
+#
+# For every concurrency level N clients list tasks while a probe client keeps requesting
+# a route that never touches Mongo. If a route blocks the event loop on a db round-trip,
+# the probe p99 climbs with N; with the async data layer it stays flat.
+
+import argparse
+import asyncio
+import json
+
+from benchmarks.asgi_client import AsgiClient, percentile
+from benchmarks.seed import bench_token, cleanup, seed
+from src.app import main_app
+from src.database.connection import DbConnection
+
+TASKS_URL = "/api/v1/tasks"
+PROBE_URL = "/docs"
+
+
+async def run_level(client: AsgiClient, clients: int, requests: int, limit: int):
+    """run one concurrency level and return the latency samples of the load and the probe"""
+    load_samples, probe_samples = [], []
+    done = asyncio.Event()
+
+    async def worker():
+        for _ in range(requests):
+            response = await client.get(TASKS_URL, params={"limit": limit})
+            load_samples.append(response.elapsed)
+
+    async def probe():
+        while not done.is_set():
+            response = await client.get(PROBE_URL)
+            probe_samples.append(response.elapsed)
+            await asyncio.sleep(0.005)
+
+    probe_task = asyncio.create_task(probe())
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    done.set()
+    await probe_task
+    return load_samples, probe_samples
+
+
+async def main(levels, requests: int, tasks: int, limit: int):
+    app = main_app()
+    db = DbConnection().db
+    await seed(db, tasks)
+    client = AsgiClient(app, headers={"authorization": f"Bearer {bench_token()}"})
+    await client.get(PROBE_URL)
+
+    report = []
+    try:
+        for clients in levels:
+            load, probe = await run_level(client, clients, requests, limit)
+            report.append({
+                "clients": clients,
+                "requests": len(load),
+                "list_p50_ms": round(percentile(load, 50) * 1000, 2),
+                "list_p99_ms": round(percentile(load, 99) * 1000, 2),
+                "probe_p50_ms": round(percentile(probe, 50) * 1000, 2),
+                "probe_p99_ms": round(percentile(probe, 99) * 1000, 2),
+            })
+    finally:
+        await cleanup(db)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="task listing latency under concurrent clients")
+    parser.add_argument("--levels", default="1,8,32,128", help="comma separated concurrent client counts")
+    parser.add_argument("--requests", type=int, default=50, help="requests issued by each client")
+    parser.add_argument("--tasks", type=int, default=200, help="tasks seeded for the benchmark user")
+    parser.add_argument("--limit", type=int, default=20, help="page size of each list request")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    results = asyncio.run(main([int(level) for level in args.levels.split(",")], args.requests, args.tasks, args.limit))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'clients':>8} {'list p50':>10} {'list p99':>10} {'probe p50':>10} {'probe p99':>10}")
+        for row in results:
+            print(f"{row['clients']:>8} {row['list_p50_ms']:>9}ms {row['list_p99_ms']:>9}ms "
+                  f"{row['probe_p50_ms']:>9}ms {row['probe_p99_ms']:>9}ms")
@@ -0,0 +1,140 @@
+# In-process load test of the API
+#
+# usage: python3 -m benchmarks.load_test --clients 32 --iterations 20 --output bench.json
+#
+# Concurrent async clients drive main_app() through the ASGI interface against a seeded
+# dataset. Every iteration of a client lists, reads, creates, updates and deletes a task,
+# and logs in again every --login-every iterations. The report holds throughput and
+# p50/p95/p99 latency per route as json, compare two reports with benchmarks.compare.
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from benchmarks.asgi_client import AsgiClient, percentile
+from benchmarks.seed import BENCH_SCOPES, BENCH_USER_NAME, BENCH_USER_PASSWORD, cleanup, seed
+from src.app import main_app
+from src.database.connection import DbConnection
+
+TASKS_URL = "/api/v1/tasks"
+TOKEN_URL = "/api/v1/token"
+
+
+class Recorder:
+    """ Collects latency samples and failures per route """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, route: str, response, expected_status: int):
+        self.samples[route].append(response.elapsed)
+        if response.status_code != expected_status:
+            self.errors[route] += 1
+
+    def summary(self, route: str, samples, elapsed: float):
+        return {
+            "count": len(samples),
+            "errors": self.errors.get(route, 0),
+            "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+            "mean_ms": round(sum(samples) / len(samples) * 1000, 3) if samples else 0.0,
+            "p50_ms": round(percentile(samples, 50) * 1000, 3),
+            "p95_ms": round(percentile(samples, 95) * 1000, 3),
+            "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        }
+
+
+async def login(client: AsgiClient, recorder: Recorder):
+    response = await client.post(TOKEN_URL, form={
+        "username": BENCH_USER_NAME, "password": BENCH_USER_PASSWORD, "scope": " ".join(BENCH_SCOPES)})
+    recorder.record("login", response, 200)
+    return response.json().get("access_token")
+
+
+async def run_client(app, recorder: Recorder, task_ids, iterations: int, login_every: int, page_size: int, rng):
+    """one client, logs in then runs the route mix for the given number of iterations"""
+    client = AsgiClient(app)
+    for iteration in range(iterations):
+        if iteration % login_every == 0:
+            token = await login(client, recorder)
+            client.headers = {"authorization": f"Bearer {token}"}
+
+        recorder.record("list", await client.get(TASKS_URL, params={"limit": page_size}), 200)
+        recorder.record("get", await client.get(f"{TASKS_URL}/{rng.choice(task_ids)}"), 200)
+
+        response = await client.post(TASKS_URL, json_body={"title": f"Load test task {iteration}", "status": "Todo"})
+        recorder.record("create", response, 201)
+        created_id = response.json().get("_id") if response.status_code == 201 else None
+        if created_id is None:
+            continue
+        recorder.record("update", await client.put(f"{TASKS_URL}/update/{created_id}",
+                                                   json_body={"title": f"Load test task {iteration}", "status": "Done"}), 200)
+        recorder.record("delete", await client.delete(f"{TASKS_URL}/delete/{created_id}"), 200)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(clients: int, iterations: int, tasks: int, login_every: int, page_size: int, random_seed: int):
+    app = main_app()
+    db = DbConnection().db
+    task_ids = await seed(db, tasks)
+    recorder = Recorder()
+    rng = random.Random(random_seed)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            run_client(app, recorder, task_ids, iterations, login_every, page_size, random.Random(rng.random()))
+            for _ in range(clients)
+        ))
+        elapsed = time.perf_counter() - started
+    finally:
+        await cleanup(db)
+
+    all_samples = [sample for samples in recorder.samples.values() for sample in samples]
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "clients": clients,
+            "iterations": iterations,
+            "seeded_tasks": tasks,
+            "login_every": login_every,
+            "page_size": page_size,
+            "elapsed_s": round(elapsed, 3),
+        },
+        "routes": {route: recorder.summary(route, samples, elapsed) for route, samples in sorted(recorder.samples.items())},
+        "total": recorder.summary("total", all_samples, elapsed),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="in-process load test of the task api")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--iterations", type=int, default=20, help="route mix iterations per client")
+    parser.add_argument("--tasks", type=int, default=1000, help="tasks seeded for the benchmark user")
+    parser.add_argument("--login-every", type=int, default=10, help="iterations between two logins of a client")
+    parser.add_argument("--page-size", type=int, default=20, help="limit of the list requests")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random task picks")
+    parser.add_argument("--output", help="write the json report to this file instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args.clients, args.iterations, args.tasks, args.login_every, args.page_size, args.seed))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
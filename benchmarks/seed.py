@@ -0,0 +1,34 @@
+# Seeded benchmark user and tasks shared by the benchmarks
+
+from scripts.generate_admin_user import create_admin_user
+from src.database.connection import get_task_crud, get_user_crud
+from src.models.schemas import Tasks, UserCreate
+from src.routes.token import create_access_token
+from src.routes.users import hash_password
+
+BENCH_USER_NAME = "benchmarkuser"
+BENCH_USER_PASSWORD = "BenchmarkUser@2023"
+BENCH_SCOPES = ["task:read", "task:write"]
+
+
+async def seed(db, tasks: int):
+    """create the benchmark user and replace its tasks with the given number of fresh ones, returns their ids"""
+    user = UserCreate(username=BENCH_USER_NAME, email="email", scopes=BENCH_SCOPES,
+                      created_by="benchmark", password=BENCH_USER_PASSWORD)
+    user.hashed_password = hash_password(user.password)
+    await create_admin_user(db, user)
+    task_crud = get_task_crud()
+    await task_crud.remove_by_user(db, BENCH_USER_NAME)
+    payloads = [Tasks(title=f"Benchmark task {index}", userId=BENCH_USER_NAME) for index in range(tasks)]
+    created, _ = await task_crud.create_many(db, payloads)
+    return [task.id for task in created if task is not None]
+
+
+async def cleanup(db):
+    await get_task_crud().remove_by_user(db, BENCH_USER_NAME)
+    await get_user_crud().remove_by_name(db, BENCH_USER_NAME)
+
+
+def bench_token() -> str:
+    """access token of the benchmark user, issued without going through the login route"""
+    return create_access_token({"sub": BENCH_USER_NAME, "scopes": BENCH_SCOPES})
@@ -0,0 +1,64 @@
+# Micro-benchmark: requests/sec of getAllTasks with the default and the fast response path
+#
+# usage: python3 -m benchmarks.serialization --sizes 100,1000 --requests 200
+#
+# The default path parses every document into Tasks, re-validates it against response_model
+# and encodes it with the stdlib json. The fast path (fast_responses setting) returns the
+# stored documents as they are and encodes them with orjson.
+
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.asgi_client import AsgiClient
+from benchmarks.seed import bench_token, cleanup, seed
+from src.app import main_app
+from src.database.connection import DbConnection
+from src.routes import tasks
+
+TASKS_URL = "/api/v1/tasks"
+
+
+async def measure(client: AsgiClient, size: int, requests: int) -> float:
+    """requests/sec of listing a page of the given size"""
+    await client.get(TASKS_URL, params={"limit": size})
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = await client.get(TASKS_URL, params={"limit": size})
+        assert response.status_code == 200
+    return requests / (time.perf_counter() - started)
+
+
+async def main(sizes, requests: int):
+    db = DbConnection().db
+    report = []
+    try:
+        for size in sizes:
+            await seed(db, size)
+            row = {"items": size}
+            for mode, fast in (("default", False), ("fast", True)):
+                tasks.settings.fast_responses = fast
+                client = AsgiClient(main_app(), headers={"authorization": f"Bearer {bench_token()}"})
+                row[f"{mode}_rps"] = round(await measure(client, size, requests), 1)
+            row["speedup"] = round(row["fast_rps"] / row["default_rps"], 2)
+            report.append(row)
+    finally:
+        await cleanup(db)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="getAllTasks requests/sec with and without the fast response path")
+    parser.add_argument("--sizes", default="100,1000", help="comma separated page sizes")
+    parser.add_argument("--requests", type=int, default=200, help="requests issued per size and mode")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    results = asyncio.run(main([int(size) for size in args.sizes.split(",")], args.requests))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'items':>6} {'default rps':>12} {'fast rps':>10} {'speedup':>8}")
+        for row in results:
+            print(f"{row['items']:>6} {row['default_rps']:>12} {row['fast_rps']:>10} {row['speedup']:>7}x")
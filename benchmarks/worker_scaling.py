@@ -0,0 +1,155 @@
+# Throughput of the served app as the number of worker processes grows
+#
+# usage: python3 -m benchmarks.worker_scaling --workers 1,2,4 --connections 64 --duration 15
+#
+# For every worker count the app is started with main.run_server (WORKERS=n) on a local port and
+# load processes keep --connections keep-alive HTTP/1.1 connections busy with GET --path for
+# --duration seconds. Unlike the in-process benchmarks this goes through uvicorn, the socket and
+# the worker processes, so it measures the serving mode itself. Run it on the host the app will
+# serve from, with the load processes pinned away from the workers when possible, since both
+# compete for the same cores.
+#
+# The default path lists tasks of the seeded benchmark user, which needs the mongo backend since
+# every worker of the memory backend has its own data. --no-auth with a path like /metrics
+# measures the web tier alone.
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.asgi_client import percentile
+
+
+def wait_until_serving(port: int, request: bytes, timeout: float):
+    """block until the server answers the benchmark request, workers keep starting during the warmup"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1) as connection:
+                connection.sendall(request)
+                if connection.recv(12).startswith(b"HTTP/1.1 200"):
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"server did not answer 200 on port {port} within {timeout}s")
+
+
+async def read_response(reader: asyncio.StreamReader):
+    """status of one HTTP/1.1 response, its body is read through its content-length"""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    length = 0
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def keep_busy(port: int, request: bytes, deadline: float, latencies, errors):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            writer.write(request)
+            status = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+def load_process(port: int, request: bytes, connections: int, duration: float):
+    """run connections clients for duration seconds, returns the latency samples and error count"""
+    latencies, errors = [], []
+
+    async def run():
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(keep_busy(port, request, deadline, latencies, errors) for _ in range(connections)))
+
+    asyncio.run(run())
+    return latencies, len(errors)
+
+
+def measure(port: int, request: bytes, connections: int, duration: float, load_processes: int):
+    shares = [connections // load_processes + (index < connections % load_processes) for index in range(load_processes)]
+    with multiprocessing.get_context("spawn").Pool(load_processes) as pool:
+        results = pool.starmap(load_process, [(port, request, share, duration) for share in shares if share])
+    latencies = [sample for samples, _ in results for sample in samples]
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors for _, errors in results),
+        "throughput_rps": round(len(latencies) / duration, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def serve(workers: int, port: int):
+    env = {**os.environ, "WORKERS": str(workers), "PORT": str(port), "BIND_IP": "127.0.0.1", "ACCESS_LOG": "false"}
+    return subprocess.Popen([sys.executable, "-m", "main"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="throughput of the served app per number of worker processes")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts")
+    parser.add_argument("--connections", type=int, default=64, help="keep-alive connections kept busy")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds of load per worker count")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of load discarded before measuring")
+    parser.add_argument("--load-processes", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--path", default="/api/v1/tasks?limit=20")
+    parser.add_argument("--tasks", type=int, default=100, help="tasks seeded for the benchmark user")
+    parser.add_argument("--no-auth", action="store_true", help="send no token and seed nothing")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--output", help="write the report as json to this file")
+    args = parser.parse_args()
+
+    headers = f"GET {args.path} HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+    if not args.no_auth:
+        from benchmarks.seed import bench_token, cleanup, seed
+        from src.database.connection import DbConnection
+        asyncio.run(seed(DbConnection().db, args.tasks))
+        headers += f"Authorization: Bearer {bench_token()}\r\n"
+    request = (headers + "\r\n").encode()
+
+    report = {"path": args.path, "connections": args.connections, "duration_s": args.duration,
+              "cpu_count": os.cpu_count(), "results": {}}
+    try:
+        for workers in [int(count) for count in args.workers.split(",")]:
+            server = serve(workers, args.port)
+            try:
+                wait_until_serving(args.port, request, timeout=30)
+                if args.warmup:
+                    measure(args.port, request, args.connections, args.warmup, args.load_processes)
+                result = measure(args.port, request, args.connections, args.duration, args.load_processes)
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=60)
+            # speedup over the first worker count of the run
+            base = next(iter(report["results"].values()), result)["throughput_rps"]
+            result["scaling"] = round(result["throughput_rps"] / base, 2) if base else 0.0
+            report["results"][str(workers)] = result
+            print(f"workers={workers:<3} rps={result['throughput_rps']:<10} p50={result['p50_ms']}ms "
+                  f"p99={result['p99_ms']}ms errors={result['errors']} scaling={result['scaling']}x")
+    finally:
+        if not args.no_auth:
+            asyncio.run(cleanup(DbConnection().db))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
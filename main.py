@@ -1,15 +1,82 @@
-from src.app import main_app
+import asyncio
+import logging
+import socket
 from src.config.config import Settings
 import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+# imported by every worker process, which builds its own app, event loop and mongo pool
+APP_FACTORY = "src.app:main_app"
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server giving in-flight requests drain_timeout seconds on shutdown, then closing what is left
+    so long-lived streams can't hold a worker forever and the app shutdown handlers still run"""
+
+    def __init__(self, config: uvicorn.Config, drain_timeout: float):
+        super().__init__(config)
+        self.drain_timeout = drain_timeout
+
+    async def shutdown(self, sockets=None):
+        loop = asyncio.get_running_loop()
+        abort = loop.call_later(self.drain_timeout, self.close_connections)
+        try:
+            await super().shutdown(sockets)
+        finally:
+            abort.cancel()
+
+    def close_connections(self):
+        if self.server_state.connections:
+            logging.warning(f"Closing {len(self.server_state.connections)} connections still open after {self.drain_timeout}s")
+        for connection in list(self.server_state.connections):
+            connection.transport.close()
+
+def server_config(settings: Settings):
+    """uvicorn config of the serving mode described by the settings"""
+    ssl = {"ssl_keyfile": settings.ssl_key, "ssl_certfile": settings.ssl_cert} if settings.ssl_cert and settings.ssl_key else {}
+    return uvicorn.Config(
+        APP_FACTORY,
+        factory=True,
+        host=settings.bind_ip,
+        port=settings.port,
+        workers=settings.workers,
+        loop=settings.event_loop,
+        http=settings.http_parser,
+        timeout_keep_alive=settings.keep_alive_timeout,
+        backlog=settings.backlog,
+        limit_concurrency=settings.limit_concurrency,
+        access_log=settings.access_log,
+        **ssl
+    )
+
+def bind_socket(config: uvicorn.Config):
+    """listening socket shared by the workers
+
+    unlike uvicorn's own it is created with proto IPPROTO_TCP, asyncio only disables Nagle on connections
+    accepted from such sockets and without it small responses wait ~40ms for the client's delayed ACK
+    """
+    family = socket.AF_INET6 if ":" in config.host else socket.AF_INET
+    sock = socket.socket(family,socket.SOCK_STREAM,socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+    sock.bind((config.host,config.port))
+    sock.set_inheritable(True)
+    logging.getLogger("uvicorn.error").info(f"Uvicorn running on {config.host}:{config.port} with {config.workers} workers")
+    return sock
 
 def run_server():
+    """serve the app with settings.workers processes sharing the listening socket
+
+    workers are spawned, not forked, and open their mongo pool in the startup event,
+    so no client or pool socket is ever shared between processes
+    """
     settings = Settings.get_settings()
-    app = main_app()
+    config = server_config(settings)
+    server = DrainingServer(config,settings.drain_timeout)
 
-    if settings.ssl_cert and settings.ssl_key:
-        uvicorn.run(app,host=settings.bind_ip,port=settings.port,ssl_keyfile=settings.ssl_key,ssl_certfile=settings.ssl_cert)
+    if config.workers > 1:
+        sock = bind_socket(config)
+        Multiprocess(config,target=server.run,sockets=[sock]).run()
     else:
-        uvicorn.run(app,host=settings.bind_ip,port=settings.port)
+        server.run()
 
 if __name__ =="__main__":
-    run_server()
\ No newline at end of file
+    run_server()
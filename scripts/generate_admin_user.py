@@ -1,13 +1,20 @@
-from src.database.connection import DbConnection
-from src.database.crud import MongoUserCrud
+import asyncio
+from src.database.connection import DbConnection, get_user_crud
 from src.routes.users import hash_password
 from src.models.schemas import UserCreate
 from src.constants import ADMIN_USER_PASSWORD, ADMIN_USER_NAME
 
 conn = DbConnection()
-crud = MongoUserCrud()
+crud = get_user_crud()
 
 
+async def create_admin_user(db, user: UserCreate):
+    """create the given admin user unless it already exists"""
+    db_user = await crud.get_by_name(db,user.username)
+    if db_user is None:
+        return await crud.create(db,user)
+    return db_user
+
 def generate_admin_user(db=None,username=None,password=None):
     """method to create an admin user"""
     username = username if username else ADMIN_USER_NAME
@@ -20,13 +27,11 @@ def generate_admin_user(db=None,username=None,password=None):
         ],created_by="script", password=password)
     
     user.hashed_password = hash_password(user.password)
-    db_user = crud.get_by_name(conn.db,user.username)
-    if db_user is None:
-        if db is None:
-            return crud.create(conn.db,user)
-        else:
-            return crud.create(db,user)
-    return db_user
+
+    async def _run():
+        return await create_admin_user(db if db is not None else conn.db, user)
+
+    return asyncio.run(_run())
 
 if __name__ == "__main__":
     generate_admin_user()
@@ -0,0 +1,25 @@
+import argparse
+import asyncio
+import json
+from src.database.connection import DbConnection
+from src.database.crud import MongoTaskCrud
+from src.database.indexes import ensure_indexes, index_report
+
+conn = DbConnection()
+
+
+async def main(command: str):
+    """apply the index registry, report drift against it or backfill the indexed search terms"""
+    if command == "apply":
+        return await ensure_indexes(conn.db)
+    if command == "backfill":
+        return {"tasks_updated": await MongoTaskCrud().backfill_title_terms(conn.db)}
+    return await index_report(conn.db)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="manage the mongo indexes of the application")
+    parser.add_argument("command", choices=["apply", "report", "backfill"],
+                        help="apply: create missing indexes, report: list missing, unregistered and unused indexes, "
+                             "backfill: set the search terms of tasks written before search existed")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main(args.command)), indent=2, default=str))
@@ -0,0 +1,185 @@
+# Admission control, keeps an overloaded worker answering quickly instead of queueing without bound
+#
+# Every route group (token, tasks, users) has a concurrency limit with a bounded queue in front of it:
+# a request waits at most admission_queue_timeout seconds for a slot and is shed with a 503 and a
+# Retry-After when the queue is full or the wait is over. Within a group every principal also has
+# a token bucket, so one busy client can't use up the capacity of the others.
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from src.config.config import Settings
+from src.constants import OVERLOADED_MSG, RATE_LIMITED_MSG
+
+settings = Settings.get_settings()
+
+# path prefix -> route group
+ROUTE_GROUPS = {
+    "/api/v1/token": "token",
+    "/api/v1/tasks": "tasks",
+    "/api/v1/users": "users",
+}
+# streams stay open for as long as the client listens, they would hold a slot forever
+LONG_LIVED_PATHS = {"/api/v1/tasks/events"}
+
+
+class Overloaded(Exception):
+    """ Raised when a request can't get a slot of its route group """
+
+
+class ConcurrencyLimiter:
+    """ At most limit requests at a time, queue_size more wait up to queue_timeout seconds in FIFO order """
+
+    def __init__(self, limit: int, queue_size: int, queue_timeout: float):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self._waiters = deque()
+
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self.limit <= 0 or (self.active < self.limit and not self._waiters):
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            self.shed += 1
+            raise Overloaded()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over as the request gave up, pass it on
+                self.release()
+            elif waiter in self._waiters:
+                # a release may already have popped and skipped the cancelled waiter
+                self._waiters.remove(waiter)
+            if isinstance(error, asyncio.TimeoutError):
+                self.shed += 1
+                raise Overloaded() from error
+            raise
+        self.admitted += 1
+
+    def release(self):
+        """free a slot, handed straight to the oldest waiter so active never drops below the queue"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"active": self.active, "waiting": self.waiting(), "admitted": self.admitted,
+                "queued": self.queued, "shed": self.shed}
+
+
+class RateLimiter:
+    """ Token bucket per key refilled with rate tokens per second up to burst, the least recently seen keys are dropped """
+
+    def __init__(self, rate: float, burst: int, max_keys: int, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self.limited = 0
+        self._buckets = OrderedDict()
+
+    def acquire(self, key) -> float:
+        """take a token of the key, returns 0 when one was available else the seconds until there is one"""
+        if self.rate <= 0:
+            return 0.0
+        now = self.clock()
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+            self.limited += 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class RouteGroup:
+    """ Concurrency limiter and per principal rate limiter of a route group """
+
+    def __init__(self, concurrency: int, queue_size: int, rate: float, burst: int):
+        self.limiter = ConcurrencyLimiter(concurrency, queue_size, settings.admission_queue_timeout)
+        self.rate_limiter = RateLimiter(rate, burst, settings.rate_limit_keys)
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.limiter.stats(), "rate_limited": self.rate_limiter.limited}
+
+
+ROUTE_GROUP_LIMITS = {
+    "token": RouteGroup(settings.token_concurrency, settings.token_queue_size, settings.token_rate, settings.token_burst),
+    "tasks": RouteGroup(settings.tasks_concurrency, settings.tasks_queue_size, settings.tasks_rate, settings.tasks_burst),
+    "users": RouteGroup(settings.users_concurrency, settings.users_queue_size, settings.users_rate, settings.users_burst),
+}
+
+
+def route_path(scope) -> str:
+    """path of the request below the root path of the app"""
+    path, root_path = scope["path"], scope.get("root_path", "")
+    return path[len(root_path):] if root_path and path.startswith(root_path) else path
+
+
+def route_group(scope) -> Optional[str]:
+    path = route_path(scope)
+    for prefix, group in ROUTE_GROUPS.items():
+        if path == prefix or path.startswith(prefix + "/"):
+            return group
+    return None
+
+
+def enforce_rate_limit(scope, key: str):
+    """take a token of the principal in the route group of the request, 429 with Retry-After when it has none"""
+    group = ROUTE_GROUP_LIMITS.get(route_group(scope))
+    if group is None:
+        return
+    wait = group.rate_limiter.acquire(key)
+    if wait:
+        retry_after = math.ceil(wait)
+        raise HTTPException(status_code=429, detail=RATE_LIMITED_MSG.format(retry_after),
+                            headers={"Retry-After": str(retry_after)})
+
+
+class AdmissionMiddleware:
+    """ ASGI middleware holding a slot of the route group for the whole request, shed requests get a 503 """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        group = ROUTE_GROUP_LIMITS.get(route_group(scope)) if scope["type"] == "http" else None
+        if group is None or route_path(scope) in LONG_LIVED_PATHS:
+            return await self.app(scope, receive, send)
+
+        try:
+            await group.limiter.acquire()
+        except Overloaded:
+            retry_after = str(max(1, math.ceil(settings.admission_queue_timeout)))
+            response = JSONResponse({"detail": OVERLOADED_MSG}, status_code=503, headers={"Retry-After": retry_after})
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            group.limiter.release()
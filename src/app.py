@@ -1,30 +1,79 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
+from src.admission import AdmissionMiddleware
 from src.config.config import Settings
+from src.constants import NEXT_CURSOR_HEADER
+from src.database.connection import DbConnection, is_memory_backend
+from src.database.indexes import ensure_indexes_on_startup
+from src.database.mongo import MongoDB
+from src.events import task_events
+from src.passwords import password_pool
+from src.metrics import MetricsMiddleware
 from src.routes.tasks import task_router
 from src.routes.users import users_router
 from src.routes.token import token_router
+from src.routes.metrics import metrics_router
 
 def main_app():
     settings = Settings.get_settings()
     origins = settings.cors_origins.split(",") if settings.cors_origins else []
 
     #Create the FastAPI application
-    app = FastAPI(root_path=settings.base_path)
+    app = FastAPI(root_path=settings.base_path,
+                  default_response_class=ORJSONResponse if settings.fast_responses else JSONResponse)
 
-    #Add middleware
+    #Add middleware, the last one added runs first
+    if settings.admission_enabled:
+        app.add_middleware(AdmissionMiddleware)
     app.add_middleware(
         CORSMiddleware,
         allow_origins=origins,
         allow_credentials=True,
         allow_methods=settings.allowed_methods,
-        allow_headers=["*"]
+        allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER, "ETag"]
     )
+    if settings.metrics_enabled:
+        app.add_middleware(MetricsMiddleware)
 
     #Add routes for the application
     app.include_router(task_router)
     app.include_router(users_router)
     app.include_router(token_router)
+    if settings.metrics_enabled:
+        app.include_router(metrics_router)
+
+    #Open the mongo pool with the app
+    if not is_memory_backend():
+        @app.on_event("startup")
+        async def connect_db():
+            MongoDB.connect()
+
+    #Create the missing indexes once the event loop is running
+    if settings.create_indexes_on_startup and not is_memory_backend():
+        @app.on_event("startup")
+        async def create_indexes():
+            await ensure_indexes_on_startup(DbConnection().db)
+
+    #Start the fan-out of task events once the db is connected
+    @app.on_event("startup")
+    async def start_task_events():
+        await task_events.start()
+
+    @app.on_event("shutdown")
+    async def stop_task_events():
+        await task_events.stop()
+
+    @app.on_event("shutdown")
+    def stop_password_pool():
+        password_pool.shutdown()
+
+    #Shutdown handlers run in registration order, the pool is closed last
+    if not is_memory_backend():
+        @app.on_event("shutdown")
+        async def close_db():
+            MongoDB.close()
 
     return app
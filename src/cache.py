@@ -0,0 +1,84 @@
+# In-process caches shared by the routes
+
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """ Bounded cache whose entries expire after ttl seconds, the least recently used entry is evicted when full """
+
+    def __init__(self, max_size: int, ttl: float, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # bumped by every invalidation, a value computed before one is not stored
+        self.generation = 0
+        self._entries = OrderedDict()
+        # key -> generation of its last invalidation, for the latest max_size invalidated keys
+        self._invalidations = OrderedDict()
+        # generation of the latest invalidation dropped from that log
+        self._forgotten = 0
+
+    def get(self, key):
+        """return the cached value or None when it is missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= self.clock():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, generation: int = None):
+        """cache the value, a cache with no room or no ttl stores nothing
+
+        generation is the one read before computing the value, the value is dropped when the key
+        was invalidated since, so a lookup racing with a write can't cache what the write removed
+        """
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        if generation is not None and self._invalidated_since(key, generation):
+            return
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        """drop the cached value of the key if any"""
+        self.generation += 1
+        self._entries.pop(key, None)
+        self._invalidations.pop(key, None)
+        self._invalidations[key] = self.generation
+        while len(self._invalidations) > max(self.max_size, 1):
+            _, self._forgotten = self._invalidations.popitem(last=False)
+
+    def clear(self):
+        self.generation += 1
+        self._forgotten = self.generation
+        self._entries.clear()
+        self._invalidations.clear()
+
+    def _invalidated_since(self, key, generation: int) -> bool:
+        if key in self._invalidations:
+            return self._invalidations[key] > generation
+        # the key may be among the forgotten invalidations
+        return self._forgotten > generation
+
+    def stats(self):
+        """hit/miss counters of the cache"""
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -1,6 +1,6 @@
 # This file contains env configurations for the application
 
-from typing import List
+from typing import List, Optional
 from pydantic import BaseSettings
 
 class Settings(BaseSettings):
@@ -12,19 +12,87 @@ class Settings(BaseSettings):
     allowed_methods: List[str] = ['GET','PUT','POST','DELETE']
     bind_ip:str =  "0.0.0.0"
     port: int = 8000
+    # encode responses with orjson and serve task lists without re-validating stored documents
+    fast_responses: bool = False
+    # request and mongo command metrics, served on /metrics
+    metrics_enabled: bool = True
     ssl_cert: str = None
     ssl_key: str = None
+    # serving, see main.run_server
+    workers: int = 1 # worker processes sharing the port, each with its own event loop and mongo pool
+    event_loop: str = "auto" # "auto" uses uvloop when it is installed, else "asyncio"
+    http_parser: str = "auto" # "auto" uses httptools when it is installed, else "h11"
+    keep_alive_timeout: int = 5 # seconds an idle keep-alive connection stays open, keep it above the load balancer's
+    backlog: int = 2048 # connections queued by the listening socket before they are refused
+    limit_concurrency: Optional[int] = None # connections and tasks per worker before answering 503
+    drain_timeout: float = 30.0 # seconds in-flight requests get on shutdown before their connections are closed
+    access_log: bool = True
+    # admission control per route group (token, tasks, users): concurrent requests of the group per worker,
+    # requests waiting for a slot, and the token bucket of every principal (username on token), 0 disables a limit
+    admission_enabled: bool = True
+    admission_queue_timeout: float = 1.0 # seconds a request waits for a slot before it is shed with a 503
+    rate_limit_keys: int = 100000 # principals tracked per group, the least recently seen are dropped
+    token_concurrency: int = 16
+    token_queue_size: int = 64
+    token_rate: float = 5.0 # logins per second and username
+    token_burst: int = 50
+    tasks_concurrency: int = 256
+    tasks_queue_size: int = 1024
+    tasks_rate: float = 100.0 # requests per second and user
+    tasks_burst: int = 200
+    users_concurrency: int = 32
+    users_queue_size: int = 128
+    users_rate: float = 20.0
+    users_burst: int = 40
     
     # Application environment variables - DataBase
+    db_backend: str = "mongo" # "mongo" or "memory", the memory backend keeps everything in the serving process
     mongo_host: str = "localhost"
     mongo_port: int = 27017
     mongo_username: str = "root"
     mongo_password: str = "example"
     db_name: str = "task_app"
+    # Mongo client pool, one per serving process, unset values keep the driver defaults
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 0
+    mongo_max_idle_time_ms: Optional[int] = None
+    mongo_max_connecting: int = 2
+    mongo_wait_queue_timeout_ms: Optional[int] = None # fail a request waiting longer than this for a pooled connection
+    mongo_server_selection_timeout_ms: int = 30000
+    mongo_connect_timeout_ms: int = 20000
+    mongo_socket_timeout_ms: Optional[int] = None
+    mongo_compressors: str = "" # e.g. "zstd,snappy,zlib", zstd needs the zstandard and snappy the python-snappy package
+    mongo_read_concern: Optional[str] = None # e.g. "local" or "majority"
+    mongo_write_concern: Optional[str] = None # e.g. "1" or "majority"
+    mongo_write_concern_journal: Optional[bool] = None
+    create_indexes_on_startup: bool = True
+    max_bulk_size: int = 1000 # items accepted by one bulk task request
+    # task summaries are cached per user, served while its task_versions counter is unchanged and for at most the ttl
+    summary_cache_size: int = 1024
+    summary_cache_ttl: float = 60.0
+    export_batch_size: int = 500 # tasks read per cursor batch and written per chunk by the export
+    # createTask inserts of concurrent requests are written together after at most this window, 0 inserts one by one
+    create_batch_window_ms: float = 0.0
+    create_batch_max_size: int = 100 # a batch reaching this size is written without waiting for the window
+    coalesce_reads: bool = True # concurrent identical task and user lookups by id or name share one query
+    # task change events, "mongo" fans them out to every worker through a capped collection
+    task_events_fanout: str = "local"
+    task_events_collection: str = "task_events"
+    task_events_capped_size: int = 16 * 1024 * 1024 # bytes of the capped collection
+    task_events_queue_size: int = 256 # events buffered per subscriber before it is asked to resync
+    task_events_keepalive: float = 15.0 # seconds between keep-alive comments on an idle stream
 
     # User related environment variables
     hash_algorithm: str = "HS256" # you can change your encryption technique for jwt token
     hash_key: str = "put_your_HS256_random_hash_key"
+    # resolved principals are cached per worker process, set the size or ttl to 0 to disable the cache
+    principal_cache_size: int = 1024
+    principal_cache_ttl: float = 30.0
+    # new hashes use the first scheme, hashes of the other schemes are upgraded on the next login
+    password_schemes: List[str] = ["sha256_crypt", "bcrypt"]
+    password_rounds: Optional[int] = None # None keeps the passlib default of the first scheme
+    password_pool_workers: int = 2 # 0 hashes on the default thread pool instead of worker processes
+    password_pool_queue_size: int = 64 # pending hashes beyond the busy workers before answering 503
     
     @classmethod
     def get_settings(cls):
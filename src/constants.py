@@ -2,6 +2,15 @@ TASK_NOT_FOUND_MSG = "Task not found error"
 USER_NOT_FOUND_MSG = "User not found error"
 DELETED_TASK_MSG = "Task {} had been deleted"
 DELETED_USER_MSG = "User {} had been deleted"
+PASSWORD_POOL_BUSY_MSG = "Too many concurrent logins, retry shortly"
+BULK_TOO_LARGE_MSG = "A bulk request accepts at most {} items"
+BULK_SKIPPED_MSG = "Not attempted, an earlier item of the ordered batch failed"
+BULK_DUPLICATE_ID_MSG = "Task id {} appears more than once in the batch"
+UNKNOWN_TASK_FIELDS_MSG = "Unknown task fields: {}, available fields are: {}"
+INVALID_CURSOR_MSG = "Invalid pagination cursor"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+OVERLOADED_MSG = "Server is overloaded, retry shortly"
+RATE_LIMITED_MSG = "Too many requests, retry in {} seconds"
 ALL_SCOPES = {
     "task:read": "Read created tasks",
     "task:write": "Create new tasks",
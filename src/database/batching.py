@@ -0,0 +1,120 @@
+# Micro-batching of single document inserts, concurrent creates share one insert_many
+#
+# Guarantees, explicitly:
+# - durability: a caller is answered only once the insert_many holding its document has been
+#   acknowledged with the write concern of the client, so an acknowledged document is as durable
+#   as with insert_one. Batching adds at most the window to the latency of a write.
+# - isolation: batches are unordered, a document failing (e.g. a duplicate _id) fails its own caller
+#   only. A connection or server error fails every caller of the batch, nothing of it is retried.
+# - ordering: _ids are assigned in call order when the batch is sent, so listings, which sort by
+#   _id, return the documents of a batch in the order they were created. The documents of a batch
+#   become visible to readers together, once the batch is written.
+# - cancellation: a caller cancelled before its batch is sent withdraws its document, once the
+#   batch is sent the document is written whatever happens to the caller.
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+
+
+class Batch:
+    """ Documents waiting for the same insert_many and the futures of their callers """
+
+    __slots__ = ("db", "entries", "timer")
+
+    def __init__(self, db):
+        self.db = db
+        self.entries = []
+        self.timer = None
+
+
+class InsertBatcher:
+    """ Collects the inserts of one collection for window seconds or until max_size documents, then writes them at once
+
+    after_flush(db, documents) runs once per batch with the written documents, before the callers resume
+    """
+
+    def __init__(self, collection: str, window: float, max_size: int,
+                 after_flush: Optional[Callable[[object, List[dict]], Awaitable]] = None):
+        self.collection = collection
+        self.window = window
+        self.max_size = max_size
+        self.after_flush = after_flush
+        self.batches = 0
+        self.documents = 0
+        self.failed = 0
+        # event loop -> batch being filled, motor clients and futures belong to one loop
+        self._filling: Dict[asyncio.AbstractEventLoop, Batch] = {}
+        # the loop only keeps weak references to tasks
+        self._flushing = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.max_size > 1
+
+    async def insert(self, db, document: dict):
+        """insert the document with the next batch, sets its _id and raises the error of its write if any"""
+        loop = asyncio.get_running_loop()
+        batch = self._filling.get(loop)
+        if batch is None or batch.db is not db:
+            if batch is not None:
+                self._send(loop)
+            batch = self._filling[loop] = Batch(db)
+            batch.timer = loop.call_later(self.window, self._send, loop)
+
+        future = loop.create_future()
+        entry = (document, future)
+        batch.entries.append(entry)
+        if len(batch.entries) >= self.max_size:
+            self._send(loop)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if self._filling.get(loop) is batch:
+                batch.entries[:] = [candidate for candidate in batch.entries if candidate is not entry]
+            raise
+
+    def _send(self, loop):
+        batch = self._filling.pop(loop, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        if batch.entries:
+            task = loop.create_task(self._flush(batch))
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+
+    async def _flush(self, batch: Batch):
+        documents = [document for document, _ in batch.entries]
+        errors = {}
+        try:
+            await batch.db[self.collection].insert_many(documents, ordered=False)
+        except BulkWriteError as error:
+            for write_error in error.details.get("writeErrors", []):
+                error_class = DuplicateKeyError if write_error.get("code") == 11000 else WriteError
+                errors[write_error["index"]] = error_class(write_error["errmsg"], write_error.get("code"), write_error)
+        except Exception as error:
+            errors = dict.fromkeys(range(len(documents)), error)
+        self.batches += 1
+        self.documents += len(documents)
+        self.failed += len(errors)
+
+        written = [document for index, document in enumerate(documents) if index not in errors]
+        if written and self.after_flush is not None:
+            try:
+                await self.after_flush(batch.db, written)
+            except Exception as error:
+                # the documents are written, their callers still succeed
+                logging.error(f"After flush of {len(written)} {self.collection} failed: {error}")
+
+        for index, (_, future) in enumerate(batch.entries):
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(None)
+
+    def stats(self):
+        return {"batches": self.batches, "documents": self.documents, "failed": self.failed}
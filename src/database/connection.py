@@ -4,26 +4,26 @@ class DbCrud(ABC):
     """ This is the abstract class who defines the crud methods needs to be implemented for Mongo CRUDs"""
     
     @abstractmethod
-    def create(self,db,payload):
+    async def create(self,db,payload):
         """Create the task from the given payload"""
         pass
     
     @abstractmethod
-    def get_by_id(self,db,_id):
+    async def get_by_id(self,db,_id):
         """Get the task by id"""
         pass
     
     @abstractmethod
-    def get_all(self,db, skip=0, limit=100):
+    async def get_all(self,db, skip=0, limit=100):
         """method to get tasks with paginated response"""
         pass
     
     @abstractmethod
-    def update_by_id(self,db,updated_payload):
+    async def update_by_id(self,db,updated_payload):
         """method to update the task details"""
         pass
     
-    def remove_by_id(self,db,_id):
+    async def remove_by_id(self,db,_id):
         """method to delete the task details"""
         pass
 
@@ -31,9 +31,53 @@ class DbCrud(ABC):
 
 class DbConnection:
     """Dependency class for providing the db connection to fastApi routes"""
-    
+
     def __init__(self):
-        from src.database.mongo import MongoDB
-        self.db = MongoDB.get_db_cursor()
+        if is_memory_backend():
+            from src.database.memory import InMemoryDB
+            self._get_db = InMemoryDB.get_db
+        else:
+            from src.database.mongo import MongoDB
+            self._get_db = MongoDB.get_db_cursor
+
+    @property
+    def db(self):
+        """async database handle of the configured backend, resolved inside the running event loop"""
+        return self._get_db()
+
+
+_db_connection = None
+
+
+async def get_db_connection() -> DbConnection:
+    """Route dependency sharing one DbConnection, and with it one client pool, across requests.
+    It is async so FastAPI resolves it on the event loop instead of a threadpool worker"""
+    global _db_connection
+    if _db_connection is None:
+        _db_connection = DbConnection()
+    return _db_connection
 
-    
\ No newline at end of file
+
+def is_memory_backend():
+    from src.config.config import Settings
+    return Settings.get_settings().db_backend == "memory"
+
+
+def get_task_crud() -> DbCrud:
+    """task CRUDs of the configured backend"""
+    if is_memory_backend():
+        from src.database.memory import InMemoryTaskCrud
+        return InMemoryTaskCrud()
+    from src.database.crud import MongoTaskCrud
+    return MongoTaskCrud()
+
+
+def get_user_crud() -> DbCrud:
+    """user CRUDs of the configured backend"""
+    if is_memory_backend():
+        from src.database.memory import InMemoryUserCrud
+        return InMemoryUserCrud()
+    from src.database.crud import MongoUserCrud
+    return MongoUserCrud()
+
+    
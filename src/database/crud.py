@@ -1,88 +1,370 @@
 import logging
+import re
+from typing import List
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 from src.database.connection import DbCrud
-from src.models.schemas import Tasks, Users,UsersResponse
-from pymongo.database import Database
+from src.models.schemas import Tasks, TaskFields, TaskSummary, Status, Users,UsersResponse, Principal
+from motor.motor_asyncio import AsyncIOMotorDatabase
 from src.config.config import Settings
 from src.models.custom_validation import PyObjectId
+from src.database.search import parse_query, title_terms, with_title_terms
+from src.singleflight import SingleFlight, coalesced
+from src.database.batching import InsertBatcher
+from src.constants import BULK_SKIPPED_MSG
 
 settings = Settings().get_settings()
 
+# stored task fields returned to clients
+TASK_PROJECTION = {"title": 1, "userId": 1, "status": 1, "contributors": 1}
+# user fields of a Principal, resolved on every authenticated request
+PRINCIPAL_PROJECTION = {"_id": 0, "username": 1, "active": 1, "scopes": 1}
+# user fields of UsersResponse, the admin listing never reads password hashes
+USER_PROJECTION = {"_id": 0, "username": 1, "email": 1, "active": 1, "scopes": 1, "created_by": 1}
+
+# lookups by id or name in flight, forgotten by every write of the collection
+task_reads = SingleFlight(settings.coalesce_reads)
+user_reads = SingleFlight(settings.coalesce_reads)
+# concurrent creates written with one insert_many, see batching.py for the guarantees
+task_inserts = InsertBatcher("tasks", settings.create_batch_window_ms / 1000, settings.create_batch_max_size,
+                             after_flush=lambda db, tasks: MongoTaskCrud().bump_versions(db, [task["userId"] for task in tasks]))
+
 class MongoTaskCrud(DbCrud):
     """This class implements the business logic to perform CRUD operations for task in the Mongo DB"""
 
-    def create(self,db: Database,payload: Tasks):
-        """Create the task from the given payload"""
+    async def create(self,db: AsyncIOMotorDatabase,payload: Tasks):
+        """Create the task from the given payload and return it, without reading it back
+
+        with create batching enabled the insert waits for the batch of concurrent creates to be written
+        """
 
-        return db.tasks.insert_one(payload.dict())
+        task = with_title_terms(payload.dict())
+        if task_inserts.enabled:
+            await task_inserts.insert(db,task)
+        else:
+            await db.tasks.insert_one(task)
+            await self.bump_versions(db,[task["userId"]])
+        return Tasks.parse_obj(task)
 
-    def get_by_id(self,db: Database,_id: str):
-        """Get the task by id"""
+    @coalesced(task_reads)
+    async def get_by_id(self,db: AsyncIOMotorDatabase,_id: str,fields: List[str]=None):
+        """Get the task by id, only the given fields (and userId, contributors for access checks) when fields are given"""
 
-        task = db.tasks.find_one({"_id":PyObjectId(_id)})
+        if fields:
+            task = await db.tasks.find_one({"_id":PyObjectId(_id)},projection(fields,"userId","contributors"))
+            return TaskFields.parse_obj(task) if task else None
+        task = await db.tasks.find_one({"_id":PyObjectId(_id)})
         return Tasks.parse_obj(task) if task else None
     
-    def get_all(self,db: Database, tasks_filters, skip:int=0, limit: int=100):
-        """method to get tasks with paginated response"""
+    async def get_all(self,db: AsyncIOMotorDatabase, tasks_filters, skip:int=0, limit: int=100, after_id=None, raw: bool=False, fields: List[str]=None):
+        """method to get tasks with paginated response, ordered by _id
 
-        tasks = []
-        index = 0
+        skip/limit/sort are applied by the server, after_id continues a keyset page
+        right after the given task id so deep pages cost the same as the first one.
+        raw returns the stored documents, already validated when written, as json ready dicts
+        and fields limits the documents to the given fields with a projection
+        """
+        if after_id is not None:
+            tasks_filters = after_filter(tasks_filters,after_id)
 
-        for task in db.tasks.find(tasks_filters):
-            tasks.append(Tasks.parse_obj(task)) if index >= skip and len(tasks) < limit else None
-            index += 1
-        return tasks
+        task_projection = projection(fields) if fields else (TASK_PROJECTION if raw else None)
+        cursor = db.tasks.find(tasks_filters,task_projection).sort("_id", ASCENDING).skip(skip).limit(limit)
+        if raw:
+            return [raw_task(task) async for task in cursor]
+        model = TaskFields if fields else Tasks
+        return [model.parse_obj(task) async for task in cursor]
     
-    def update_by_id(self,db: Database,_id,updated_payload: Tasks):
-        """method to update the task details"""
+    async def iter_all(self,db: AsyncIOMotorDatabase, tasks_filters, batch_size: int=500):
+        """yield raw task documents ordered by _id, straight from the cursor without building models
+
+        only one server batch of documents is held in memory at a time
+        """
+        cursor = db.tasks.find(tasks_filters,TASK_PROJECTION).sort("_id", ASCENDING).batch_size(batch_size)
+        async for task in cursor:
+            yield task
+
+    async def summary(self,db: AsyncIOMotorDatabase,user_id: str):
+        """count the tasks of the user per status and per contributor with one aggregation"""
+
+        pipeline = [
+            {"$match": {"userId": user_id}},
+            {"$facet": {
+                "status": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+                "contributors": [
+                    {"$unwind": "$contributors"},
+                    {"$group": {"_id": "$contributors", "count": {"$sum": 1}}}
+                ],
+            }},
+        ]
+        facets = (await db.tasks.aggregate(pipeline).to_list(length=1))[0]
+        status_counts = {status: 0 for status in Status}
+        status_counts.update({group["_id"]: group["count"] for group in facets["status"]})
+        return TaskSummary(
+            total=sum(status_counts.values()),
+            status=status_counts,
+            contributors={group["_id"]: group["count"] for group in facets["contributors"]}
+        )
+
+    async def update_by_id(self,db: AsyncIOMotorDatabase,_id,updated_payload: Tasks,user_id: str=None):
+        """method to update the task details and return the updated task in one round-trip
+
+        when user_id is given only a task owned by that user is updated, None means no task matched
+        """
+        filter = {"_id":PyObjectId(_id)}
+        if user_id is not None:
+            filter["userId"] = user_id
+        task = await db.tasks.find_one_and_update(filter,{"$set": with_title_terms(updated_payload.dict(exclude_none=True))},
+                                                  return_document=ReturnDocument.AFTER)
+        if not task:
+            return None
+        logging.info(f"Task: ${_id} updated successfully")
+        # an update may hand the task over to another user, both lists changed then
+        await self.bump_versions(db,[user_id,task["userId"]])
+        return Tasks.parse_obj(task)
+
+    async def remove_by_id(self,db: AsyncIOMotorDatabase,_id: str,user_id: str=None):
+        """method to delete the task details, only a task owned by user_id when it is given"""
+
         filter = {"_id":PyObjectId(_id)}
-        task_obj = db.tasks.update_one(filter,{"$set": updated_payload.dict(exclude_none=True)})
-        logging.info(f"Task: ${updated_payload.id} updated successfully")
-        return task_obj
+        if user_id is not None:
+            filter["userId"] = user_id
+        if user_id is None:
+            task = await db.tasks.find_one_and_delete(filter,{"userId":1})
+            deleted_count = 1 if task else 0
+            user_id = task and task["userId"]
+        else:
+            deleted_count = (await db.tasks.delete_one(filter)).deleted_count
+        if deleted_count:
+            await self.bump_versions(db,[user_id])
+        return deleted_count
 
-    def remove_by_id(self,db: Database,_id: str):
-        """method to delete the task details"""
+    async def remove_by_user(self,db: AsyncIOMotorDatabase,user_id: str):
+        """method to delete every task of the user"""
 
-        task_obj = db.tasks.delete_one({"_id":PyObjectId(_id)})
+        task_obj = await db.tasks.delete_many({"userId":user_id})
+        if task_obj.deleted_count:
+            await self.bump_versions(db,[user_id])
         return task_obj.deleted_count
 
+    async def create_many(self,db: AsyncIOMotorDatabase,payloads: List[Tasks],ordered: bool=True):
+        """Create the tasks with one insert_many
+
+        returns the created tasks, None for the items not written, and {index: error} for those items
+        """
+        tasks = [with_title_terms(payload.dict()) for payload in payloads]
+        errors = {}
+        if tasks:
+            try:
+                await db.tasks.insert_many(tasks,ordered=ordered)
+            except BulkWriteError as error:
+                errors = bulk_write_errors(error,len(tasks),ordered)
+            await self.bump_versions(db,[task["userId"] for index, task in enumerate(tasks) if index not in errors])
+        return [None if index in errors else Tasks.parse_obj(task) for index, task in enumerate(tasks)], errors
+
+    async def update_many(self,db: AsyncIOMotorDatabase,payloads: List[Tasks],user_id: str,ordered: bool=True):
+        """Update the tasks of user_id with one bulk_write, every payload carries the id of its task
+
+        returns {task id: updated task} for the tasks that matched and {index: error} for failed writes.
+        The owned tasks are listed before the write, an update may hand a task over so they can't be
+        told apart by owner afterwards
+        """
+        errors = {}
+        owned_ids = set()
+        if payloads:
+            ids = [PyObjectId(payload.id) for payload in payloads]
+            owned_ids = {task["_id"] async for task in db.tasks.find({"_id":{"$in":ids},"userId":user_id},{"_id":1})}
+            operations = [
+                UpdateOne({"_id":PyObjectId(payload.id),"userId":user_id},
+                          {"$set": with_title_terms(payload.dict(exclude_none=True,exclude={"id"}))})
+                for payload in payloads
+            ]
+            try:
+                await db.tasks.bulk_write(operations,ordered=ordered)
+            except BulkWriteError as error:
+                errors = bulk_write_errors(error,len(operations),ordered)
+
+        written_ids = [PyObjectId(payload.id) for index, payload in enumerate(payloads) if index not in errors]
+        updated = {}
+        if written_ids:
+            # ownership was enforced by the write filters, the tasks may belong to their new owners by now
+            async for task in db.tasks.find({"_id":{"$in":[_id for _id in written_ids if _id in owned_ids]}}):
+                updated[str(task["_id"])] = Tasks.parse_obj(task)
+        if written_ids:
+            # payloads may hand tasks over to other users, their lists changed too
+            await self.bump_versions(db,[user_id,*(payload.userId for index, payload in enumerate(payloads) if index not in errors)])
+        return updated, errors
+
+    async def remove_many(self,db: AsyncIOMotorDatabase,ids: List[str],user_id: str):
+        """Delete the tasks of user_id with the given ids, returns the ids that were deleted"""
+
+        object_ids = [PyObjectId(_id) for _id in ids]
+        owned_ids = [task["_id"] async for task in db.tasks.find({"_id":{"$in":object_ids},"userId":user_id},{"_id":1})]
+        if owned_ids:
+            await db.tasks.delete_many({"_id":{"$in":owned_ids},"userId":user_id})
+            await self.bump_versions(db,[user_id])
+        return {str(_id) for _id in owned_ids}
+
+    async def search(self,db: AsyncIOMotorDatabase,user_id: str,query: str,status: Status=None,prefix: bool=True,skip: int=0,limit: int=20):
+        """search the tasks of the user by title, most relevant first
+
+        whole terms go through the userId/title text index, which ranks the tasks, and must all be
+        titleTerms; the trailing prefix is an anchored regex on the userId/titleTerms multikey index.
+        Both are scoped to the user by the index prefix, so the cost follows the matches, not the tasks
+        """
+        whole_terms, prefix_term = parse_query(query,prefix)
+        if not whole_terms and not prefix_term:
+            return []
+        filters = {"userId": user_id}
+        if status:
+            filters["status"] = status
+        term_filters = []
+        if whole_terms:
+            filters["$text"] = {"$search": " ".join(whole_terms)}
+            term_filters.append({"titleTerms": {"$all": whole_terms}})
+        if prefix_term:
+            term_filters.append({"titleTerms": {"$regex": f"^{re.escape(prefix_term)}"}})
+        filters["$and"] = term_filters
+
+        if whole_terms:
+            score = {"$meta": "textScore"}
+            cursor = db.tasks.find(filters,{**TASK_PROJECTION,"score": score}).sort([("score", score),("_id", ASCENDING)])
+        else:
+            cursor = db.tasks.find(filters,TASK_PROJECTION).sort("_id", ASCENDING)
+        return [Tasks.parse_obj(task) async for task in cursor.skip(skip).limit(limit)]
+
+    async def backfill_title_terms(self,db: AsyncIOMotorDatabase,batch_size: int=500):
+        """set the titleTerms of tasks written before search existed, returns the number of tasks updated"""
+
+        updated = 0
+        operations = []
+        async for task in db.tasks.find({"titleTerms": {"$exists": False}},{"title": 1}).batch_size(batch_size):
+            operations.append(UpdateOne({"_id": task["_id"]},{"$set": {"titleTerms": title_terms(task.get("title"))}}))
+            if len(operations) >= batch_size:
+                updated += (await db.tasks.bulk_write(operations,ordered=False)).modified_count
+                operations = []
+        if operations:
+            updated += (await db.tasks.bulk_write(operations,ordered=False)).modified_count
+        return updated
+
+    async def get_version(self,db: AsyncIOMotorDatabase,user_id: str):
+        """change counter of the tasks of the user, read from task_versions without touching the tasks collection"""
+
+        version = await db.task_versions.find_one({"_id":user_id})
+        return version["version"] if version else 0
+
+    async def bump_versions(self,db: AsyncIOMotorDatabase,user_ids: List[str]):
+        """increment the change counter of every given user, called by each task write once it is applied
+
+        bumping after the write means a reader that got the new counter also reads the new tasks
+        """
+        task_reads.forget()
+        user_ids = {user_id for user_id in user_ids if user_id is not None}
+        if user_ids:
+            await db.task_versions.bulk_write(
+                [UpdateOne({"_id":user_id},{"$inc": {"version": 1}},upsert=True) for user_id in user_ids],
+                ordered=False
+            )
+
+def user_filter(scopes: List[str]=None,active: bool=None,created_by: str=None):
+    """filter of the admin user listing, a user must have every given scope"""
+    users_filters = {}
+    if scopes:
+        users_filters["$and"] = [{"scopes": scope} for scope in scopes]
+    if active is not None:
+        users_filters["active"] = active
+    if created_by is not None:
+        users_filters["created_by"] = created_by
+    return users_filters
+
+def visible_filter(user_id: str,status: Status=None):
+    """filter of the tasks the user owns or contributes to, status is repeated in both branches
+    so each of them is answered by its own index"""
+    branches = [{"userId": user_id},{"contributors": user_id}]
+    if status:
+        branches = [{**branch,"status": status} for branch in branches]
+    return {"$or": branches}
+
+def after_filter(tasks_filters: dict,after_id):
+    """restrict the filters to the tasks after after_id, inside every $or branch so each stays an index range"""
+    if "$or" in tasks_filters:
+        return {**tasks_filters,"$or": [{**branch,"_id": {"$gt": after_id}} for branch in tasks_filters["$or"]]}
+    return {**tasks_filters,"_id": {"$gt": after_id}}
+
+def projection(fields: List[str],*required: str):
+    """mongo projection of the given fields, _id is always included"""
+    return dict.fromkeys([*fields,*required],1)
+
+def raw_task(task: dict):
+    """make a projected task document json ready"""
+    task["_id"] = str(task["_id"])
+    return task
+
+def bulk_write_errors(error: BulkWriteError,total: int,ordered: bool):
+    """map a BulkWriteError to {index: error}, an ordered batch never attempts the items after the first failure"""
+    errors = {write_error["index"]: write_error["errmsg"] for write_error in error.details.get("writeErrors",[])}
+    if ordered and errors:
+        errors.update({index: BULK_SKIPPED_MSG for index in range(min(errors)+1,total)})
+    return errors
+
 class MongoUserCrud(DbCrud):
     """This class implements the business logic to perform CRUD operations for users in the Mongo DB"""
 
-    def create(self,db: Database,payload: Users):
+    async def create(self,db: AsyncIOMotorDatabase,payload: Users):
         """Create the user from the given payload"""
 
-        return db.users.insert_one(payload.dict())
+        user_obj = await db.users.insert_one(payload.dict())
+        user_reads.forget()
+        return user_obj
 
-    def get_by_id(self,db: Database,_id: str):
+    @coalesced(user_reads)
+    async def get_by_id(self,db: AsyncIOMotorDatabase,_id: str):
         """Get the user by id"""
 
-        user = db.users.find_one({"_id":PyObjectId(_id)})
+        user = await db.users.find_one({"_id":PyObjectId(_id)})
         return Users.parse_obj(user) if user else None
 
-    def get_by_name(self,db: Database, username):
-        user = db.users.find_one({"username":username})
+    @coalesced(user_reads)
+    async def get_by_name(self,db: AsyncIOMotorDatabase, username):
+        user = await db.users.find_one({"username":username})
         return Users.parse_obj(user) if user else None
-    
-    def get_all(self,db: Database, skip:int=0, limit: int=100):
-        """method to get users with paginated response"""
 
-        users = []
-        index = 0
+    @coalesced(user_reads)
+    async def get_principal(self,db: AsyncIOMotorDatabase, username):
+        """Get the principal of the user, reads only the fields authorization needs"""
 
-        for user in db.users.find():
-            users.append(Users.parse_obj(user)) if index >= skip and len(user) < limit else None
-            index += 1
-        return users
+        user = await db.users.find_one({"username":username},PRINCIPAL_PROJECTION)
+        return Principal.from_document(user) if user else None
     
-    def update_by_id(self,db: Database,_id,updated_payload: Tasks):
+    async def get_all(self,db: AsyncIOMotorDatabase, users_filters: dict=None, skip:int=0, limit: int=100, after: str=None):
+        """method to get users with paginated response, ordered by username
+
+        filtering, skip/limit and the sort are applied by the server through the username indexes,
+        after continues a keyset page right after the given username. Only the UsersResponse fields are read
+        """
+        users_filters = dict(users_filters or {})
+        if after is not None:
+            users_filters["username"] = {"$gt": after}
+        cursor = db.users.find(users_filters,USER_PROJECTION).sort("username", ASCENDING).skip(skip).limit(limit)
+        return [UsersResponse.parse_obj(user) async for user in cursor]
+    
+    async def update_by_id(self,db: AsyncIOMotorDatabase,_id,updated_payload: Tasks):
         """method to update the user details"""
         filter = {"_id":PyObjectId(_id)}
-        user_obj = db.users.update_one(filter,{"$set": updated_payload.dict(exclude_none=True)})
+        user_obj = await db.users.update_one(filter,{"$set": updated_payload.dict(exclude_none=True)})
+        user_reads.forget()
         logging.info(f"User: ${updated_payload.id} updated successfully")
         return user_obj
 
-    def remove_by_name(self,db: Database,username: str):
+    async def update_password(self,db: AsyncIOMotorDatabase,username: str,hashed_password: str):
+        """method to replace the password hash of the user"""
+
+        user_obj = await db.users.update_one({"username":username},{"$set": {"hashed_password": hashed_password}})
+        user_reads.forget()
+        return user_obj.modified_count
+
+    async def remove_by_name(self,db: AsyncIOMotorDatabase,username: str):
         """method to delete the user details"""
 
-        user_obj = db.users.delete_one({"username":username})
-        return user_obj.deleted_count
\ No newline at end of file
+        user_obj = await db.users.delete_one({"username":username})
+        user_reads.forget()
+        return user_obj.deleted_count
@@ -0,0 +1,102 @@
+# Declarative registry of the indexes every collection needs, applied idempotently
+
+import logging
+from pymongo import ASCENDING, TEXT, IndexModel
+from pymongo.errors import PyMongoError
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+# collection name -> indexes that must exist on it
+INDEXES = {
+    "users": [
+        # get_by_name runs on every authenticated request
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        # the admin listing pages on username, filtered by any of these
+        IndexModel([("created_by", ASCENDING), ("username", ASCENDING)], name="created_by_username"),
+        IndexModel([("active", ASCENDING), ("username", ASCENDING)], name="active_username"),
+        IndexModel([("scopes", ASCENDING), ("username", ASCENDING)], name="scopes_username"),
+    ],
+    "tasks": [
+        # getAllTasks filters on userId (and optionally status) and pages on _id
+        IndexModel([("userId", ASCENDING), ("_id", ASCENDING)], name="userId_id"),
+        IndexModel([("userId", ASCENDING), ("status", ASCENDING), ("_id", ASCENDING)], name="userId_status_id"),
+        # the shared view ORs the owner branch with a contributor branch on these multikey indexes,
+        # every branch is read in _id order and merged, so pages stay index bounded
+        IndexModel([("contributors", ASCENDING), ("_id", ASCENDING)], name="contributors_id"),
+        IndexModel([("contributors", ASCENDING), ("status", ASCENDING), ("_id", ASCENDING)], name="contributors_status_id"),
+        # searchTasks: whole terms through the text index, scoped to the user by its prefix, without
+        # stemming or stop words so it agrees with titleTerms; prefixes through the titleTerms multikey index
+        IndexModel([("userId", ASCENDING), ("title", TEXT)], name="userId_title_text", default_language="none"),
+        IndexModel([("userId", ASCENDING), ("titleTerms", ASCENDING)], name="userId_titleTerms"),
+    ],
+}
+
+# collection name -> representative queries of the routes, checked with explain for collection scans
+QUERY_SHAPES = {
+    "users": [
+        {"filter": {"username": ""}},
+        {"filter": {}, "sort": {"username": ASCENDING}},
+        {"filter": {"created_by": ""}, "sort": {"username": ASCENDING}},
+        {"filter": {"active": False}, "sort": {"username": ASCENDING}},
+        {"filter": {"scopes": "admin:user"}, "sort": {"username": ASCENDING}},
+    ],
+    "tasks": [
+        {"filter": {"userId": ""}, "sort": {"_id": ASCENDING}},
+        {"filter": {"userId": "", "status": "Todo"}, "sort": {"_id": ASCENDING}},
+        {"filter": {"$or": [{"userId": ""}, {"contributors": ""}]}, "sort": {"_id": ASCENDING}},
+        {"filter": {"userId": "", "titleTerms": {"$regex": "^a"}}},
+    ],
+}
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    """create every registered index, indexes that already exist with the same spec are left untouched"""
+    created = {}
+    for collection, indexes in INDEXES.items():
+        created[collection] = await db[collection].create_indexes(indexes)
+        logging.info(f"Indexes ensured on {collection}: {created[collection]}")
+    return created
+
+
+async def ensure_indexes_on_startup(db: AsyncIOMotorDatabase):
+    """startup hook, a failing index build is logged instead of keeping the app down"""
+    try:
+        await ensure_indexes(db)
+    except PyMongoError as error:
+        logging.error(f"Could not ensure indexes: {error}")
+
+
+def _plan_stages(plan: dict):
+    """yield every stage name of an explain plan tree"""
+    yield plan.get("stage")
+    if "inputStage" in plan:
+        yield from _plan_stages(plan["inputStage"])
+    for stage in plan.get("inputStages", []):
+        yield from _plan_stages(stage)
+
+
+async def index_report(db: AsyncIOMotorDatabase):
+    """report registered indexes that are missing, present ones that are not registered or never used,
+    and registered query shapes whose winning plan still scans the collection"""
+    report = {}
+    for collection, indexes in INDEXES.items():
+        expected = {index.document["name"] for index in indexes}
+        existing = set((await db[collection].index_information()).keys()) - {"_id_"}
+
+        usage = {}
+        async for stats in db[collection].aggregate([{"$indexStats": {}}]):
+            usage[stats["name"]] = stats["accesses"]["ops"]
+
+        collection_scans = []
+        for shape in QUERY_SHAPES.get(collection, []):
+            explain = await db.command("explain", {"find": collection, **shape}, verbosity="queryPlanner")
+            stages = set(_plan_stages(explain["queryPlanner"]["winningPlan"]))
+            if "COLLSCAN" in stages:
+                collection_scans.append(shape)
+
+        report[collection] = {
+            "missing": sorted(expected - existing),
+            "unregistered": sorted(existing - expected),
+            "unused": sorted(name for name in existing if usage.get(name) == 0),
+            "collection_scans": collection_scans,
+        }
+    return report
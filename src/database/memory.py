@@ -0,0 +1,539 @@
+# In-memory storage backend implementing the task and user CRUD contracts, selected with db_backend="memory"
+#
+# Documents are kept as dicts, like mongo would return them, and served through secondary
+# indexes so reads never scan the collection: tasks by id, per user and per (user, status)
+# lists ordered by _id, an inverted index of the title terms of every user, and users by
+# username. Everything lives in the serving process.
+
+import heapq
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from copy import deepcopy
+from enum import Enum
+from typing import List
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from src.database.connection import DbCrud
+from src.database.crud import TASK_PROJECTION, USER_PROJECTION, raw_task
+from src.database.search import parse_query, relevance, title_terms
+from src.models.schemas import Tasks, TaskFields, TaskSummary, Status, Users, UsersResponse, Principal
+from src.models.custom_validation import PyObjectId
+from src.constants import BULK_SKIPPED_MSG
+
+
+def to_document(payload: dict):
+    """copy a payload into a stored document, enums are stored by value like bson does"""
+    return {key: value.value if isinstance(value, Enum) else deepcopy(value) for key, value in payload.items()}
+
+
+def project(document: dict, fields):
+    """copy of the document limited to _id and the given fields"""
+    return {"_id": document["_id"], **{field: deepcopy(document[field]) for field in fields if field in document}}
+
+
+def matches(document: dict, filters: dict):
+    """equality match of the plain filters, $or and $and, an array field matches a value it contains like in mongo"""
+    for key, value in filters.items():
+        if key == "$or":
+            if not any(matches(document, to_document(branch)) for branch in value):
+                return False
+        elif key == "$and":
+            if not all(matches(document, to_document(branch)) for branch in value):
+                return False
+        elif not key.startswith("$"):
+            stored = document.get(key)
+            if stored != value and not (isinstance(stored, list) and value in stored):
+                return False
+    return True
+
+
+def unique(ids):
+    """drop the repeats of sorted ids"""
+    previous = None
+    for _id in ids:
+        if _id != previous:
+            yield _id
+        previous = _id
+
+
+class SortedIndex:
+    """ Secondary index, key -> ids kept sorted so pages can start right after any id """
+
+    def __init__(self):
+        self.entries = defaultdict(list)
+
+    def add(self, key, _id: ObjectId):
+        insort(self.entries[key], _id)
+
+    def discard(self, key, _id: ObjectId):
+        ids = self.entries.get(key)
+        if not ids:
+            return
+        position = bisect_right(ids, _id) - 1
+        if position >= 0 and ids[position] == _id:
+            del ids[position]
+        if not ids:
+            del self.entries[key]
+
+    def get(self, key):
+        return self.entries.get(key, [])
+
+
+class TermIndex:
+    """ Inverted index, (user, term) -> task ids, with the terms of every user sorted for prefix lookups """
+
+    def __init__(self):
+        self.postings = defaultdict(set)
+        self.terms = defaultdict(list)
+
+    def add(self, user, terms, _id: ObjectId):
+        for term in terms:
+            ids = self.postings[(user, term)]
+            if not ids:
+                insort(self.terms[user], term)
+            ids.add(_id)
+
+    def discard(self, user, terms, _id: ObjectId):
+        for term in terms:
+            ids = self.postings.get((user, term))
+            if ids is None:
+                continue
+            ids.discard(_id)
+            if not ids:
+                del self.postings[(user, term)]
+                user_terms = self.terms[user]
+                del user_terms[bisect_left(user_terms, term)]
+                if not user_terms:
+                    del self.terms[user]
+
+    def get(self, user, term):
+        return self.postings.get((user, term), set())
+
+    def prefixed(self, user, prefix: str):
+        """ids of the tasks of the user having a term starting with prefix, found by bisecting the sorted terms"""
+        user_terms = self.terms.get(user, [])
+        ids = set()
+        for position in range(bisect_left(user_terms, prefix), len(user_terms)):
+            if not user_terms[position].startswith(prefix):
+                break
+            ids |= self.postings[(user, user_terms[position])]
+        return ids
+
+
+class TaskStore:
+    """ Task documents and their indexes """
+
+    def __init__(self):
+        self.by_id = {}
+        self.ids = []
+        self.by_user = SortedIndex()
+        self.by_user_status = SortedIndex()
+        # multikey, a task is listed under each of its contributors
+        self.by_contributor = SortedIndex()
+        self.by_contributor_status = SortedIndex()
+        self.by_title = TermIndex()
+
+    def _index(self, task: dict):
+        insort(self.ids, task["_id"])
+        self.by_user.add(task.get("userId"), task["_id"])
+        self.by_user_status.add((task.get("userId"), task.get("status")), task["_id"])
+        for contributor in set(task.get("contributors") or ()):
+            self.by_contributor.add(contributor, task["_id"])
+            self.by_contributor_status.add((contributor, task.get("status")), task["_id"])
+        self.by_title.add(task.get("userId"), title_terms(task.get("title")), task["_id"])
+
+    def _unindex(self, task: dict):
+        del self.ids[bisect_right(self.ids, task["_id"]) - 1]
+        self.by_user.discard(task.get("userId"), task["_id"])
+        self.by_user_status.discard((task.get("userId"), task.get("status")), task["_id"])
+        for contributor in set(task.get("contributors") or ()):
+            self.by_contributor.discard(contributor, task["_id"])
+            self.by_contributor_status.discard((contributor, task.get("status")), task["_id"])
+        self.by_title.discard(task.get("userId"), title_terms(task.get("title")), task["_id"])
+
+    def insert(self, task: dict):
+        task.setdefault("_id", ObjectId())
+        if task["_id"] in self.by_id:
+            raise DuplicateKeyError(f"duplicate key: {task['_id']}")
+        self.by_id[task["_id"]] = task
+        self._index(task)
+
+    def update(self, task: dict, changes: dict):
+        self._unindex(task)
+        task.update(changes)
+        self._index(task)
+
+    def remove(self, task: dict):
+        self._unindex(task)
+        del self.by_id[task["_id"]]
+
+    def find(self, filters: dict, after_id: ObjectId = None):
+        """yield the tasks matching the filters in _id order, through the narrowest index
+
+        the index is walked lazily, callers must not write to the store while iterating
+        """
+        filters = to_document(filters)
+        if "$or" in filters:
+            # one index walk per branch, merged in _id order like mongo's SORT_MERGE
+            walks = [self._walk(self._ids({**filters, **to_document(branch)}), after_id) for branch in filters["$or"]]
+            ids = unique(heapq.merge(*walks))
+        else:
+            ids = self._walk(self._ids(filters), after_id)
+        for _id in ids:
+            task = self.by_id[_id]
+            if matches(task, filters):
+                yield task
+
+    def _ids(self, filters: dict):
+        """sorted ids of the narrowest index for the filters"""
+        status = filters.get("status")
+        if "userId" in filters:
+            return self.by_user_status.get((filters["userId"], status)) if status else self.by_user.get(filters["userId"])
+        if "contributors" in filters:
+            if status:
+                return self.by_contributor_status.get((filters["contributors"], status))
+            return self.by_contributor.get(filters["contributors"])
+        return self.ids
+
+    @staticmethod
+    def _walk(ids, after_id: ObjectId = None):
+        position = bisect_right(ids, after_id) if after_id is not None else 0
+        while position < len(ids):
+            yield ids[position]
+            position += 1
+
+    def search(self, user_id: str, whole_terms, prefix_term: str = None):
+        """tasks of the user having every whole term and a term starting with prefix_term, smallest posting first"""
+        candidates = [self.by_title.get(user_id, term) for term in whole_terms]
+        if prefix_term:
+            candidates.append(self.by_title.prefixed(user_id, prefix_term))
+        if not candidates:
+            return []
+        candidates.sort(key=len)
+        ids = set(candidates[0]).intersection(*candidates[1:])
+        return [self.by_id[_id] for _id in ids]
+
+    def find_owned(self, _id: str, user_id: str = None):
+        task = self.by_id.get(PyObjectId(_id))
+        if task is None or (user_id is not None and task.get("userId") != user_id):
+            return None
+        return task
+
+
+class UserStore:
+    """ User documents indexed by id and by username, usernames are unique
+
+    the listing indexes hold usernames kept sorted, like the username indexes of the users collection
+    """
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_name = {}
+        self.names = []
+        self.by_created_by = SortedIndex()
+        self.by_scope = SortedIndex()
+
+    def _index(self, user: dict):
+        insort(self.names, user["username"])
+        self.by_created_by.add(user.get("created_by"), user["username"])
+        for scope in set(scope_value(scope) for scope in user.get("scopes") or ()):
+            self.by_scope.add(scope, user["username"])
+
+    def _unindex(self, user: dict):
+        del self.names[bisect_left(self.names, user["username"])]
+        self.by_created_by.discard(user.get("created_by"), user["username"])
+        for scope in set(scope_value(scope) for scope in user.get("scopes") or ()):
+            self.by_scope.discard(scope, user["username"])
+
+    def insert(self, user: dict):
+        if user["username"] in self.by_name:
+            raise DuplicateKeyError(f"duplicate key: {user['username']}")
+        user.setdefault("_id", ObjectId())
+        self.by_id[user["_id"]] = user
+        self.by_name[user["username"]] = user
+        self._index(user)
+
+    def update(self, user: dict, changes: dict):
+        if changes.get("username", user["username"]) != user["username"]:
+            if changes["username"] in self.by_name:
+                raise DuplicateKeyError(f"duplicate key: {changes['username']}")
+            del self.by_name[user["username"]]
+            self.by_name[changes["username"]] = user
+        self._unindex(user)
+        user.update(changes)
+        self._index(user)
+
+    def remove(self, user: dict):
+        self._unindex(user)
+        del self.by_id[user["_id"]]
+        del self.by_name[user["username"]]
+
+    def find(self, filters: dict, after: str = None):
+        """yield the users matching the filters in username order, through the narrowest index"""
+        filters = to_document(filters)
+        if "created_by" in filters:
+            names = self.by_created_by.get(filters["created_by"])
+        elif filters.get("$and"):
+            names = self.by_scope.get(scope_value(filters["$and"][0]["scopes"]))
+        else:
+            names = self.names
+        position = bisect_right(names, after) if after is not None else 0
+        while position < len(names):
+            user = self.by_name[names[position]]
+            position += 1
+            if matches(user, filters):
+                yield user
+
+
+def scope_value(scope):
+    """scopes are stored as enums by pydantic payloads, indexes key them by value"""
+    return scope.value if isinstance(scope, Enum) else scope
+
+
+class InMemoryDB:
+    """ Process wide in-memory database, the counterpart of MongoDB for the memory backend """
+
+    db = None
+
+    def __init__(self):
+        self.tasks = TaskStore()
+        self.users = UserStore()
+        # username -> change counter of its tasks
+        self.task_versions = defaultdict(int)
+
+    @classmethod
+    def get_db(cls):
+        if cls.db is None:
+            cls.db = InMemoryDB()
+        return cls.db
+
+
+class InsertedUser:
+    """ Result of InMemoryUserCrud.create, shaped like pymongo's InsertOneResult """
+
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class InMemoryTaskCrud(DbCrud):
+    """This class implements the CRUD operations for task on the in-memory backend, mirroring MongoTaskCrud"""
+
+    async def create(self,db: InMemoryDB,payload: Tasks):
+        """Create the task from the given payload and return it"""
+
+        task = to_document(payload.dict())
+        db.tasks.insert(task)
+        await self.bump_versions(db,[task["userId"]])
+        return Tasks.parse_obj(task)
+
+    async def get_by_id(self,db: InMemoryDB,_id: str,fields: List[str]=None):
+        """Get the task by id, only the given fields (and userId for access checks) when fields are given"""
+
+        task = db.tasks.find_owned(_id)
+        if task is None:
+            return None
+        if fields:
+            return TaskFields.parse_obj(project(task,[*fields,"userId","contributors"]))
+        return Tasks.parse_obj(task)
+
+    async def get_all(self,db: InMemoryDB, tasks_filters, skip:int=0, limit: int=100, after_id=None, raw: bool=False, fields: List[str]=None):
+        """method to get tasks with paginated response, ordered by _id, see MongoTaskCrud.get_all"""
+
+        tasks = []
+        for index, task in enumerate(db.tasks.find(tasks_filters,after_id)):
+            if index < skip:
+                continue
+            if len(tasks) >= limit:
+                break
+            tasks.append(task)
+
+        selected = fields or list(TASK_PROJECTION)
+        if raw:
+            return [raw_task(project(task,selected)) for task in tasks]
+        if fields:
+            return [TaskFields.parse_obj(project(task,fields)) for task in tasks]
+        return [Tasks.parse_obj(task) for task in tasks]
+
+    async def iter_all(self,db: InMemoryDB, tasks_filters, batch_size: int=500):
+        """yield task documents ordered by _id, a batch at a time so writes between batches are safe"""
+        after_id = None
+        while True:
+            batch = []
+            for task in db.tasks.find(tasks_filters,after_id):
+                batch.append(project(task,TASK_PROJECTION))
+                if len(batch) >= batch_size:
+                    break
+            if not batch:
+                return
+            after_id = batch[-1]["_id"]
+            for task in batch:
+                yield task
+
+    async def summary(self,db: InMemoryDB,user_id: str):
+        """count the tasks of the user per status and per contributor"""
+
+        status_counts = {status: len(db.tasks.by_user_status.get((user_id,status.value))) for status in Status}
+        contributors = defaultdict(int)
+        for task in db.tasks.find({"userId":user_id}):
+            for contributor in task.get("contributors") or []:
+                contributors[contributor] += 1
+        return TaskSummary(total=sum(status_counts.values()),status=status_counts,contributors=contributors)
+
+    async def update_by_id(self,db: InMemoryDB,_id,updated_payload: Tasks,user_id: str=None):
+        """method to update the task details, scoped to user_id when given, returns the updated task or None"""
+
+        task = db.tasks.find_owned(_id,user_id)
+        if task is None:
+            return None
+        owner = task["userId"]
+        db.tasks.update(task,to_document(updated_payload.dict(exclude_none=True)))
+        await self.bump_versions(db,[owner,task["userId"]])
+        return Tasks.parse_obj(task)
+
+    async def remove_by_id(self,db: InMemoryDB,_id: str,user_id: str=None):
+        """method to delete the task details, only a task owned by user_id when it is given"""
+
+        task = db.tasks.find_owned(_id,user_id)
+        if task is None:
+            return 0
+        db.tasks.remove(task)
+        await self.bump_versions(db,[task["userId"]])
+        return 1
+
+    async def remove_by_user(self,db: InMemoryDB,user_id: str):
+        """method to delete every task of the user"""
+
+        tasks = list(db.tasks.find({"userId":user_id}))
+        for task in tasks:
+            db.tasks.remove(task)
+        if tasks:
+            await self.bump_versions(db,[user_id])
+        return len(tasks)
+
+    async def create_many(self,db: InMemoryDB,payloads: List[Tasks],ordered: bool=True):
+        """Create the tasks, see MongoTaskCrud.create_many"""
+
+        created, errors = [], {}
+        for index, payload in enumerate(payloads):
+            if ordered and errors:
+                errors[index] = BULK_SKIPPED_MSG
+                created.append(None)
+                continue
+            task = to_document(payload.dict())
+            try:
+                db.tasks.insert(task)
+                created.append(Tasks.parse_obj(task))
+            except DuplicateKeyError as error:
+                errors[index] = str(error)
+                created.append(None)
+        await self.bump_versions(db,[task.userId for task in created if task])
+        return created, errors
+
+    async def update_many(self,db: InMemoryDB,payloads: List[Tasks],user_id: str,ordered: bool=True):
+        """Update the tasks of user_id, see MongoTaskCrud.update_many"""
+
+        updated = {}
+        for payload in payloads:
+            task = db.tasks.find_owned(payload.id,user_id)
+            if task is not None:
+                db.tasks.update(task,to_document(payload.dict(exclude_none=True,exclude={"id"})))
+                updated[payload.id] = Tasks.parse_obj(task)
+        if updated:
+            await self.bump_versions(db,[user_id,*(task.userId for task in updated.values())])
+        return updated, {}
+
+    async def remove_many(self,db: InMemoryDB,ids: List[str],user_id: str):
+        """Delete the tasks of user_id with the given ids, returns the ids that were deleted"""
+
+        deleted = set()
+        for _id in ids:
+            task = db.tasks.find_owned(_id,user_id)
+            if task is not None:
+                db.tasks.remove(task)
+                deleted.add(_id)
+        if deleted:
+            await self.bump_versions(db,[user_id])
+        return deleted
+
+    async def search(self,db: InMemoryDB,user_id: str,query: str,status: Status=None,prefix: bool=True,skip: int=0,limit: int=20):
+        """search the tasks of the user by title through the inverted index, see MongoTaskCrud.search"""
+
+        whole_terms, prefix_term = parse_query(query,prefix)
+        tasks = db.tasks.search(user_id,whole_terms,prefix_term)
+        if status:
+            tasks = [task for task in tasks if task.get("status") == to_document({"status": status})["status"]]
+        ranked = heapq.nsmallest(skip+limit,tasks,key=lambda task: (-relevance(task.get("title"),whole_terms),task["_id"]))
+        return [Tasks.parse_obj(task) for task in ranked[skip:]]
+
+    async def get_version(self,db: InMemoryDB,user_id: str):
+        """change counter of the tasks of the user, see MongoTaskCrud.get_version"""
+        return db.task_versions.get(user_id,0)
+
+    async def bump_versions(self,db: InMemoryDB,user_ids: List[str]):
+        """increment the change counter of every given user, called by each task write once it is applied"""
+        for user_id in {user_id for user_id in user_ids if user_id is not None}:
+            db.task_versions[user_id] += 1
+
+class InMemoryUserCrud(DbCrud):
+    """This class implements the CRUD operations for users on the in-memory backend, mirroring MongoUserCrud"""
+
+    async def create(self,db: InMemoryDB,payload: Users):
+        """Create the user from the given payload"""
+
+        user = to_document(payload.dict())
+        db.users.insert(user)
+        return InsertedUser(user["_id"])
+
+    async def get_by_id(self,db: InMemoryDB,_id: str):
+        """Get the user by id"""
+
+        user = db.users.by_id.get(PyObjectId(_id))
+        return Users.parse_obj(user) if user else None
+
+    async def get_by_name(self,db: InMemoryDB, username):
+        user = db.users.by_name.get(username)
+        return Users.parse_obj(user) if user else None
+
+    async def get_principal(self,db: InMemoryDB, username):
+        """Get the principal of the user"""
+
+        user = db.users.by_name.get(username)
+        return Principal.from_document(user) if user else None
+
+    async def get_all(self,db: InMemoryDB, users_filters: dict=None, skip:int=0, limit: int=100, after: str=None):
+        """method to get users with paginated response, ordered by username, see MongoUserCrud.get_all"""
+
+        users = []
+        for index, user in enumerate(db.users.find(users_filters or {},after)):
+            if index < skip:
+                continue
+            if len(users) >= limit:
+                break
+            users.append(UsersResponse.parse_obj(project(user,USER_PROJECTION)))
+        return users
+
+    async def update_by_id(self,db: InMemoryDB,_id,updated_payload: Users):
+        """method to update the user details"""
+
+        user = db.users.by_id.get(PyObjectId(_id))
+        if user is not None:
+            db.users.update(user,to_document(updated_payload.dict(exclude_none=True)))
+        return user is not None
+
+    async def update_password(self,db: InMemoryDB,username: str,hashed_password: str):
+        """method to replace the password hash of the user"""
+
+        user = db.users.by_name.get(username)
+        if user is None:
+            return 0
+        db.users.update(user,{"hashed_password":hashed_password})
+        return 1
+
+    async def remove_by_name(self,db: InMemoryDB,username: str):
+        """method to delete the user details"""
+
+        user = db.users.by_name.get(username)
+        if user is None:
+            return 0
+        db.users.remove(user)
+        return 1
@@ -1,20 +1,81 @@
+import asyncio
 import logging
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 from src.config.config import Settings
+from src.metrics import MongoCommandMetrics, MongoPoolMetrics
 class MongoDB:
-    """This class defines the mongo connection"""
+    """This class defines the mongo connection
+
+    The app opens the client on startup and closes it on shutdown, every route then shares
+    its connection pool. Scripts and tests that never run the startup event get a client
+    lazily. motor binds a client to the event loop it is first used on, so the loop is kept
+    alongside it and a client used from another loop is replaced.
+    """
 
     settings = Settings.get_settings()
-    client = MongoClient(
-        host=settings.mongo_host,
-        port=settings.mongo_port,
-        username=settings.mongo_username,
-        password=settings.mongo_password
-    )
+    _loop = None
+    _client = None
+    _db = None
+
+    @classmethod
+    def client_options(cls):
+        """pool, timeout, compression and read/write concern options of the client, unset ones keep the driver default"""
+        settings = cls.settings
+        write_concern = settings.mongo_write_concern
+        options = {
+            "maxPoolSize": settings.mongo_max_pool_size,
+            "minPoolSize": settings.mongo_min_pool_size,
+            "maxIdleTimeMS": settings.mongo_max_idle_time_ms,
+            "maxConnecting": settings.mongo_max_connecting,
+            "waitQueueTimeoutMS": settings.mongo_wait_queue_timeout_ms,
+            "serverSelectionTimeoutMS": settings.mongo_server_selection_timeout_ms,
+            "connectTimeoutMS": settings.mongo_connect_timeout_ms,
+            "socketTimeoutMS": settings.mongo_socket_timeout_ms,
+            "compressors": settings.mongo_compressors or None,
+            "readConcernLevel": settings.mongo_read_concern,
+            "w": int(write_concern) if write_concern and write_concern.isdigit() else write_concern,
+            "journal": settings.mongo_write_concern_journal,
+        }
+        return {name: value for name, value in options.items() if value is not None}
+
+    @classmethod
+    def connect(cls):
+        """Open the client on the running event loop, called on app startup"""
+        loop = asyncio.get_running_loop()
+        if cls._client is not None and cls._loop is loop:
+            return cls._client
+        cls.close()
+        event_listeners = [MongoCommandMetrics(), MongoPoolMetrics()] if cls.settings.metrics_enabled else []
+        cls._client = AsyncIOMotorClient(
+            host=cls.settings.mongo_host,
+            port=cls.settings.mongo_port,
+            username=cls.settings.mongo_username,
+            password=cls.settings.mongo_password,
+            event_listeners=event_listeners,
+            io_loop=loop,
+            **cls.client_options()
+        )
+        cls._loop = loop
+        cls._db = cls._client[cls.settings.db_name]
+        logging.info(f"Connected to db instance: {cls.settings.mongo_host}")
+        return cls._client
+
+    @classmethod
+    def close(cls):
+        """Close the client and its pool, called on app shutdown"""
+        if cls._client is not None:
+            cls._client.close()
+        cls._client = cls._loop = cls._db = None
 
-    db = client[settings.db_name]
+    @classmethod
+    def get_client(cls):
+        """Return the motor client bound to the running event loop"""
+        if cls._client is None or cls._loop is not asyncio.get_running_loop():
+            cls.connect()
+        return cls._client
 
     @classmethod
     def get_db_cursor(cls):
-        logging.debug(f"Connected to db instance: {cls.settings.mongo_host}")
-        return cls.db
\ No newline at end of file
+        if cls._db is None or cls._loop is not asyncio.get_running_loop():
+            cls.connect()
+        return cls._db
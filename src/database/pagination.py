@@ -0,0 +1,41 @@
+# Opaque cursor tokens used for keyset pagination
+
+import base64
+import json
+from bson import ObjectId
+
+
+def encode_cursor(last_id) -> str:
+    """encode the sort key of the last returned document into an opaque token"""
+    raw = json.dumps({"id": str(last_id)}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> ObjectId:
+    """decode a token produced by encode_cursor, raises ValueError for malformed tokens"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        last_id = json.loads(base64.urlsafe_b64decode(padded.encode()))["id"]
+    except (ValueError, TypeError, KeyError) as error:
+        raise ValueError("Invalid cursor") from error
+    if not ObjectId.is_valid(last_id):
+        raise ValueError("Invalid cursor")
+    return ObjectId(last_id)
+
+
+def encode_key_cursor(last_key: str) -> str:
+    """encode a string sort key, e.g. a username, of the last returned document into an opaque token"""
+    raw = json.dumps({"key": last_key}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_key_cursor(token: str) -> str:
+    """decode a token produced by encode_key_cursor, raises ValueError for malformed tokens"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        last_key = json.loads(base64.urlsafe_b64decode(padded.encode()))["key"]
+    except (ValueError, TypeError, KeyError) as error:
+        raise ValueError("Invalid cursor") from error
+    if not isinstance(last_key, str):
+        raise ValueError("Invalid cursor")
+    return last_key
@@ -0,0 +1,46 @@
+# Title tokenizing shared by the task search of every backend
+#
+# A title is split into lowercased word terms, stored on mongo tasks as titleTerms and kept in an
+# inverted index by the memory backend. Every term of a query must be a term of the title, the last
+# one may be a prefix of a title term so results follow a query that is still being typed.
+
+import re
+from typing import List, Optional, Tuple
+
+TERM = re.compile(r"\w+")
+
+
+def terms(text: Optional[str]) -> List[str]:
+    """lowercased word terms of the text in order, duplicates included"""
+    return TERM.findall(text.lower()) if text else []
+
+
+def title_terms(title: Optional[str]) -> List[str]:
+    """distinct terms of a title, as stored and indexed"""
+    return list(dict.fromkeys(terms(title)))
+
+
+def with_title_terms(document: dict) -> dict:
+    """add the titleTerms of a task document about to be written, when it carries a title"""
+    if document.get("title") is not None:
+        document["titleTerms"] = title_terms(document["title"])
+    return document
+
+
+def parse_query(query: str, prefix: bool = True) -> Tuple[List[str], Optional[str]]:
+    """split a search query into the terms matched whole and the trailing term matched as a prefix
+
+    the last term is a prefix when prefix is set and the query does not end with a space
+    """
+    words = terms(query)
+    if prefix and words and not query[-1].isspace():
+        return list(dict.fromkeys(words[:-1])), words[-1]
+    return list(dict.fromkeys(words)), None
+
+
+def relevance(title: str, query_terms: List[str]) -> float:
+    """score of a title for the terms matched whole, occurrences weighted by the title length"""
+    words = terms(title)
+    if not words or not query_terms:
+        return 0.0
+    return sum(words.count(term) for term in query_terms) / len(words)
@@ -0,0 +1,214 @@
+# Task change notifications, streamed to subscribers instead of having clients poll the task list
+#
+# The task write routes publish an event per written task to the process wide broker, which queues
+# it for every subscriber of the users it concerns. The broker hands events to a fan-out first:
+# LocalFanOut delivers them straight back to this process, MongoFanOut carries them through a capped
+# collection tailed by every worker so subscribers see the writes served by the other processes too.
+
+import asyncio
+import itertools
+import logging
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Optional
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, PyMongoError
+from src.config.config import Settings
+
+settings = Settings.get_settings()
+
+
+class TaskEventType:
+    CREATED = "created"
+    UPDATED = "updated"
+    DELETED = "deleted"
+    # sent to a subscriber that fell too far behind, it should re-list its tasks
+    RESYNC = "resync"
+
+
+class TaskEvent:
+    """ A task write, delivered to the subscribers of every user in users """
+
+    __slots__ = ("type", "users", "task")
+
+    def __init__(self, type: str, users: Iterable[str], task: dict):
+        self.type = type
+        self.users = frozenset(user for user in users if user)
+        self.task = task
+
+    def to_document(self):
+        return {"type": self.type, "users": sorted(self.users), "task": self.task}
+
+    @classmethod
+    def from_document(cls, document: dict):
+        return cls(document["type"], document["users"], document["task"])
+
+
+class Subscription:
+    """ Bounded queue of the events of one user for one connection, bound to the loop of that connection """
+
+    def __init__(self, user_id: str, queue_size: int):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(queue_size)
+        self.overflowed = False
+
+    def put(self, event: TaskEvent):
+        if self.loop is asyncio.get_running_loop():
+            self._put(event)
+        else:
+            self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event: TaskEvent):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # dropping single events would silently desync the client, end the stream with a resync instead
+            self.overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(TaskEvent(TaskEventType.RESYNC, (self.user_id,), {}))
+
+    async def get(self, timeout: float) -> Optional[TaskEvent]:
+        """next event, None when nothing happened within timeout"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LocalFanOut:
+    """ Fan-out of a single process, published events are delivered right away """
+
+    def __init__(self):
+        self.deliver = None
+
+    async def start(self, deliver: Callable[[TaskEvent], None]):
+        self.deliver = deliver
+
+    async def stop(self):
+        pass
+
+    async def publish(self, event: TaskEvent):
+        self.deliver(event)
+
+
+class MongoFanOut:
+    """ Fan-out across worker processes through a capped collection that every worker tails
+
+    events are appended by the publishing worker and read back by all of them, this one included,
+    so every subscriber sees the writes in the order mongo stored them. Delivery is best effort:
+    events older than the capped collection size are lost for a worker that fell behind.
+    """
+
+    def __init__(self, get_db: Callable, collection: str, size: int):
+        self.get_db = get_db
+        self.collection = collection
+        self.size = size
+        self._task = None
+
+    async def start(self, deliver: Callable[[TaskEvent], None]):
+        db = self.get_db()
+        try:
+            await db.create_collection(self.collection, capped=True, size=self.size)
+        except CollectionInvalid:
+            pass
+        last = await db[self.collection].find_one(sort=[("$natural", -1)])
+        if last is None:
+            # a tailable cursor on an empty capped collection is closed right away
+            last = {"_id": (await db[self.collection].insert_one({"type": None})).inserted_id}
+        self._task = asyncio.create_task(self._tail(db, deliver, last["_id"]))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def publish(self, event: TaskEvent):
+        """append the event, a failing insert is logged since the write it reports already committed"""
+        try:
+            await self.get_db()[self.collection].insert_one(event.to_document())
+        except PyMongoError as error:
+            logging.warning(f"Task event of {len(event.users)} users not published: {error}")
+
+    async def _tail(self, db, deliver, last_id):
+        while True:
+            try:
+                cursor = db[self.collection].find({"_id": {"$gt": last_id}}, cursor_type=CursorType.TAILABLE_AWAIT)
+                async for document in cursor:
+                    last_id = document["_id"]
+                    if document.get("type"):
+                        deliver(TaskEvent.from_document(document))
+            except PyMongoError as error:
+                logging.warning(f"Task event tail interrupted: {error}")
+            await asyncio.sleep(1)
+
+
+class EventBroker:
+    """ In-process pub/sub of task events, keyed by user """
+
+    def __init__(self, queue_size: int, fanout=None):
+        self.queue_size = queue_size
+        self.fanout = fanout or LocalFanOut()
+        self.published = 0
+        self.delivered = 0
+        self.resyncs = 0 # streams ended because their subscriber fell behind
+        self._subscribers: Dict[str, set] = defaultdict(set)
+        self._started = False
+
+    async def start(self):
+        """start the fan-out, on app startup"""
+        if not self._started:
+            await self.fanout.start(self.deliver)
+            self._started = True
+
+    async def stop(self):
+        if self._started:
+            await self.fanout.stop()
+            self._started = False
+
+    def subscribe(self, user_id: str) -> Subscription:
+        subscription = Subscription(user_id, self.queue_size)
+        self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.user_id]
+
+    def subscribers(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    async def publish(self, events: Iterable[TaskEvent]):
+        """hand the events to the fan-out, skipped when the fan-out is local and nobody listens to their users"""
+        local = isinstance(self.fanout, LocalFanOut)
+        for event in events:
+            if local and self._subscribers.keys().isdisjoint(event.users):
+                continue
+            if not self._started:
+                await self.start()
+            self.published += 1
+            await self.fanout.publish(event)
+
+    def deliver(self, event: TaskEvent):
+        """queue the event for every subscriber of its users, called by the fan-out"""
+        for subscription in itertools.chain.from_iterable(
+                self._subscribers.get(user, ()) for user in event.users):
+            subscription.put(event)
+            self.delivered += 1
+
+
+def create_task_events() -> EventBroker:
+    """broker of the configured fan-out, the memory backend only has the local one"""
+    from src.database.connection import is_memory_backend
+    fanout = None
+    if settings.task_events_fanout == "mongo" and not is_memory_backend():
+        from src.database.mongo import MongoDB
+        fanout = MongoFanOut(MongoDB.get_db_cursor, settings.task_events_collection, settings.task_events_capped_size)
+    return EventBroker(settings.task_events_queue_size, fanout)
+
+
+task_events = create_task_events()
@@ -0,0 +1,240 @@
+# Lightweight in-process metrics rendered in the Prometheus text format
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Tuple
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = ""):
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """ Base class of the metrics, values are kept per tuple of label values """
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        # the mongo listeners run on the motor executor threads
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """yield (line without value, value) pairs of the metric"""
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)}", value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{sample} {value}" for sample, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (),
+                 callback: Callable[[], Dict[Tuple, float]] = None):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels: Tuple = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+    def set(self, labels: Tuple = (), value: float = 0):
+        self._values[labels] = value
+
+    def samples(self):
+        if self.callback is not None:
+            self._values = dict(self.callback())
+        return super().samples()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels: Tuple, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # per bucket counts (last one is +Inf), sum, count
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        for labels, (counts, total, count) in list(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                bucket_label = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, bucket_label)}", cumulative
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)}", total
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)}", count
+
+
+class Registry:
+    """ Keeps every metric of the process and renders them for the /metrics endpoint """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: Metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status")))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route")))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "HTTP requests being served"))
+MONGO_COMMANDS = REGISTRY.register(Counter(
+    "mongo_commands_total", "Mongo commands by collection, operation and outcome", ("collection", "command", "outcome")))
+MONGO_LATENCY = REGISTRY.register(Histogram(
+    "mongo_command_duration_seconds", "Mongo command latency by collection and operation", ("collection", "command")))
+MONGO_POOL_WAIT = REGISTRY.register(Histogram(
+    "mongo_pool_wait_seconds", "Time spent waiting for a pooled mongo connection", ("address",)))
+MONGO_POOL_CONNECTIONS = REGISTRY.register(Gauge(
+    "mongo_pool_connections", "Open and checked out mongo connections per server", ("address", "state")))
+MONGO_POOL_CHECKOUT_FAILURES = REGISTRY.register(Counter(
+    "mongo_pool_checkout_failures_total", "Mongo connection checkouts that failed, by reason", ("address", "reason")))
+
+
+class MetricsMiddleware:
+    """ ASGI middleware recording request counts, latency and in-flight requests per route template """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            # the router stores the matched route in the shared scope, templates keep the label set bounded
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            HTTP_REQUESTS.inc((scope["method"], route_path, str(status_code)))
+            HTTP_LATENCY.observe((scope["method"], route_path), elapsed)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """ pymongo command listener timing every command by collection and operation """
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = \
+            collection if isinstance(collection, str) else event.database_name
+
+    def _finished(self, event, outcome: str):
+        collection = self._collections.pop((event.connection_id, event.request_id), "unknown")
+        MONGO_COMMANDS.inc((collection, event.command_name, outcome))
+        MONGO_LATENCY.observe((collection, event.command_name), event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finished(event, "success")
+
+    def failed(self, event):
+        self._finished(event, "failure")
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """ pymongo pool listener recording connection checkout wait time and pool occupancy """
+
+    def __init__(self):
+        # a checkout starts and ends on the same executor thread
+        self._checkout_started = threading.local()
+
+    @staticmethod
+    def _address(event):
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def connection_check_out_started(self, event):
+        self._checkout_started.value = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._checkout_started, "value", None)
+        if started is not None:
+            MONGO_POOL_WAIT.observe((self._address(event),), time.perf_counter() - started)
+        MONGO_POOL_CONNECTIONS.inc((self._address(event), "checked_out"))
+
+    def connection_check_out_failed(self, event):
+        started = getattr(self._checkout_started, "value", None)
+        if started is not None:
+            MONGO_POOL_WAIT.observe((self._address(event),), time.perf_counter() - started)
+        MONGO_POOL_CHECKOUT_FAILURES.inc((self._address(event), str(event.reason)))
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CONNECTIONS.dec((self._address(event), "checked_out"))
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.inc((self._address(event), "open"))
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.dec((self._address(event), "open"))
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
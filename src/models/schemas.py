@@ -2,7 +2,7 @@ from enum import Enum
 from pydantic import BaseModel, Field, validator
 from src.models.custom_validation import PyObjectId
 import re
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 
 class AuthScopeEnum(str,Enum):
     TASK_READ="task:read"
@@ -15,6 +15,11 @@ class Status(str, Enum):
     IN_PROGRESS = "In Progress"
     DONE = "Done"
 
+class TaskView(str, Enum):
+    OWNED = "owned"
+    # tasks the user owns or contributes to
+    SHARED = "shared"
+
 class TokenData(BaseModel):
     """ This class defines token data """
     username: Optional[str] = None
@@ -28,6 +33,20 @@ class Users(BaseModel):
     created_by: Optional[str]
     hashed_password: Optional[str]
 
+class Principal:
+    """ The fields of a user that authorization needs, built from a projected read of the user """
+
+    __slots__ = ("username", "active", "scopes")
+
+    def __init__(self, username: str, active: bool = True, scopes=()):
+        self.username = username
+        self.active = active
+        self.scopes = tuple(scopes)
+
+    @classmethod
+    def from_document(cls, document: dict):
+        return cls(document["username"], document.get("active", True), document.get("scopes") or ())
+
 class UserCreate(Users):
     password: str
 
@@ -61,3 +80,48 @@ class Tasks(BaseModel):
         if stripped_title:
             return stripped_title
         raise ValueError("Title value must be provided")
+
+# task fields a client can select with the fields query parameter, _id is always returned
+TASK_FIELDS = ("title", "userId", "status", "contributors")
+
+class TaskFields(BaseModel):
+    """ A task read with a projection, only the selected fields are present """
+    id: Optional[PyObjectId] = Field(alias='_id')
+    title: Optional[str]
+    userId: Optional[str]
+    status: Optional[Status]
+    contributors: Optional[List[str]]
+
+class TaskSummary(BaseModel):
+    """ Task counts of a user per status and per contributor """
+    total: int
+    status: Dict[Status, int]
+    contributors: Dict[str, int]
+
+
+class BulkItemStatus(str, Enum):
+    CREATED = "created"
+    UPDATED = "updated"
+    DELETED = "deleted"
+    INVALID = "invalid"
+    NOT_FOUND = "not_found"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+
+class BulkTaskRequest(BaseModel):
+    """ Items are validated one by one, an ordered batch stops at the first failing item """
+    items: List[Dict[str, Any]]
+    ordered: bool = True
+
+class BulkTaskDeleteRequest(BaseModel):
+    items: List[str]
+    ordered: bool = True
+
+class BulkItemResult(BaseModel):
+    index: int
+    status: BulkItemStatus
+    id: Optional[str]
+    error: Optional[str]
+
+class BulkTaskResponse(BaseModel):
+    results: List[BulkItemResult]
@@ -0,0 +1,86 @@
+# Password hashing and verification, run on a worker process pool so logins never block the event loop
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from passlib.context import CryptContext
+from src.config.config import Settings
+
+settings = Settings.get_settings()
+
+
+class PasswordPoolSaturated(Exception):
+    """ Raised when every worker is busy and the queue of pending hashes is full """
+
+
+@lru_cache(maxsize=8)
+def get_crypt_context(schemes: Tuple[str, ...], rounds: Optional[int]) -> CryptContext:
+    """
+    crypt context hashing with the first scheme, hashes of the other schemes still verify and get upgraded
+    :param schemes: passlib scheme names, the first one is used for new hashes
+    :param rounds: rounds of the first scheme, None keeps the passlib default
+    """
+    options = {f"{schemes[0]}__rounds": rounds} if rounds else {}
+    return CryptContext(schemes=list(schemes), deprecated="auto", **options)
+
+
+def hash_with(password: str, schemes: Tuple[str, ...], rounds: Optional[int]) -> str:
+    return get_crypt_context(schemes, rounds).hash(password)
+
+
+def verify_and_update_with(password: str, hashed_password: str, schemes: Tuple[str, ...],
+                           rounds: Optional[int]) -> Tuple[bool, Optional[str]]:
+    """returns whether the password matches and, if the hash is outdated, its replacement"""
+    return get_crypt_context(schemes, rounds).verify_and_update(password, hashed_password)
+
+
+class PasswordPool:
+    """ This class runs password hashing on a pool of worker processes with a bounded queue """
+
+    def __init__(self, schemes: List[str], rounds: Optional[int], workers: int, queue_size: int):
+        self.schemes = tuple(schemes)
+        self.rounds = rounds
+        self.workers = workers
+        self.queue_size = queue_size
+        self.in_flight = 0
+        self.rejected = 0
+        self._executor = None
+
+    def _get_executor(self):
+        # created lazily so every serving process owns its pool, spawn keeps the db threads out of the workers
+        if self._executor is None and self.workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self.in_flight >= max(self.workers, 1) + self.queue_size:
+            self.rejected += 1
+            raise PasswordPoolSaturated()
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.in_flight -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_with, password, self.schemes, self.rounds)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._run(verify_and_update_with, password, hashed_password, self.schemes, self.rounds)
+
+    def hash_sync(self, password: str) -> str:
+        """hash in the calling process, for scripts running outside the app"""
+        return hash_with(password, self.schemes, self.rounds)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+password_pool = PasswordPool(settings.password_schemes, settings.password_rounds,
+                             settings.password_pool_workers, settings.password_pool_queue_size)
@@ -0,0 +1,46 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from src.metrics import REGISTRY, Gauge
+from src.admission import ROUTE_GROUP_LIMITS
+from src.database.crud import task_inserts, task_reads, user_reads
+from src.events import task_events
+from src.passwords import password_pool
+from src.routes.tasks import summary_cache
+from src.routes.users import principal_cache
+
+metrics_router = APIRouter(tags=["Metrics"])
+
+CACHES = {"principal": principal_cache, "task_summary": summary_cache}
+
+REGISTRY.register(Gauge(
+    "app_cache", "Size, hits, misses and evictions of the in-process caches", ("cache", "stat"),
+    callback=lambda: {(name, stat): value for name, cache in CACHES.items() for stat, value in cache.stats().items()}))
+REGISTRY.register(Gauge(
+    "password_pool", "Hashes in flight on the password pool and hashes rejected because it was saturated", ("stat",),
+    callback=lambda: {("in_flight",): password_pool.in_flight, ("rejected",): password_pool.rejected}))
+
+REGISTRY.register(Gauge(
+    "task_events", "Open task event streams, events published and delivered, and streams ended with a resync", ("stat",),
+    callback=lambda: {("subscribers",): task_events.subscribers(), ("published",): task_events.published,
+                      ("delivered",): task_events.delivered, ("resyncs",): task_events.resyncs}))
+
+REGISTRY.register(Gauge(
+    "admission", "Active, waiting, admitted, queued, shed and rate limited requests per route group", ("group", "stat"),
+    callback=lambda: {(name, stat): value for name, group in ROUTE_GROUP_LIMITS.items() for stat, value in group.stats().items()}))
+
+FLIGHTS = {"task_reads": task_reads, "user_reads": user_reads}
+REGISTRY.register(Gauge(
+    "single_flight", "Coalesced lookups: calls, queries executed for them and calls sharing a query in flight", ("reads", "stat"),
+    callback=lambda: {(name, stat): value for name, flight in FLIGHTS.items() for stat, value in flight.stats().items()}))
+
+REGISTRY.register(Gauge(
+    "task_insert_batches", "Batched task creates: batches written, documents in them and documents that failed", ("stat",),
+    callback=lambda: {(stat,): value for stat, value in task_inserts.stats().items()}))
+
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def getMetrics():
+    """
+    This function exposes the metrics of the serving process in the Prometheus text format
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
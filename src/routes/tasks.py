@@ -1,13 +1,21 @@
 #!/usr/bin/python3
 # coding= utf-8
-from fastapi import APIRouter, Depends, HTTPException, Security
-from fastapi.responses import JSONResponse
+import hashlib
+import json
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, Security
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from typing import List, Optional
-from src.models.schemas import Tasks, Users, Status
+from src.models.schemas import Tasks, TaskFields, TaskSummary, TASK_FIELDS, TaskView, Principal, Status, BulkTaskRequest, BulkTaskDeleteRequest, BulkTaskResponse, BulkItemResult, BulkItemStatus
+from src.models.custom_validation import PyObjectId
+from src.config.config import Settings
+from src.cache import TTLCache
+from src.events import TaskEvent, TaskEventType, task_events
 from src.routes.users import get_current_active_user
-from src.database.connection import DbConnection
-from src.database.crud import MongoTaskCrud
-from src.constants import TASK_NOT_FOUND_MSG, DELETED_TASK_MSG
+from src.database.connection import get_db_connection, get_task_crud
+from src.database.crud import raw_task, visible_filter
+from src.database.pagination import decode_cursor, encode_cursor
+from src.constants import TASK_NOT_FOUND_MSG, DELETED_TASK_MSG, INVALID_CURSOR_MSG, UNKNOWN_TASK_FIELDS_MSG, NEXT_CURSOR_HEADER, BULK_TOO_LARGE_MSG, BULK_SKIPPED_MSG, BULK_DUPLICATE_ID_MSG
 
 task_router = APIRouter(
     prefix="/api/v1/tasks",
@@ -15,79 +23,339 @@ task_router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-crud = MongoTaskCrud()
+FIELDS_QUERY = Query(None, description=f"comma separated subset of {', '.join(TASK_FIELDS)} to return, _id is always returned")
+
+settings = Settings.get_settings()
+crud = get_task_crud()
+# username -> (task version, TaskSummary), served while the change counter of the user is unchanged
+summary_cache = TTLCache(settings.summary_cache_size, settings.summary_cache_ttl)
 
 @task_router.get("",response_model=List[Tasks])
-async def getAllTasks(status: Optional[Status] = None ,skip: int = 0, limit: int = 100, conn=Depends(DbConnection),current_user: Users = Security(get_current_active_user, scopes=["task:read"])):
-    """Route to return all the tasks from db"""
+async def getAllTasks(request: Request, response: Response, status: Optional[Status] = None, view: TaskView = TaskView.OWNED, skip: int = Query(0, ge=0), limit: int = Query(100, ge=1), cursor: Optional[str] = None, fields: Optional[str] = FIELDS_QUERY, conn=Depends(get_db_connection),current_user: Principal = Security(get_current_active_user, scopes=["task:read"])):
+    """Route to return all the tasks from db
+
+    A full page carries an opaque cursor in the X-Next-Cursor header,
+    pass it back as cursor to continue right after the last returned task.
+    fields limits every task to the selected fields, read with a mongo projection.
+    The ETag follows the change counter of the user, a matching If-None-Match gets a 304
+    without reading the tasks.
+    view=shared also lists the tasks the user contributes to, with the same pagination.
+    The counter only follows owned tasks, so this view carries no ETag
+    """
+    if view == TaskView.SHARED:
+        task_filters = visible_filter(current_user.username,status)
+    else:
+        task_filters = {"userId": current_user.username}
+        if status:
+            task_filters["status"] = status
+
+    try:
+        after_id = decode_cursor(cursor) if cursor else None
+    except ValueError as error:
+        raise HTTPException(status_code=400,detail=INVALID_CURSOR_MSG) from error
+
+    query_fields = parseTaskFields(fields)
+    headers = {}
+    if view == TaskView.OWNED:
+        etag = headers["ETag"] = await taskEtag(request,conn.db,current_user)
+        if etagMatches(request,etag):
+            return Response(status_code=304,headers=headers)
+    raw = settings.fast_responses
+    data = await crud.get_all(conn.db,task_filters,skip,limit,after_id,raw=raw,fields=query_fields)
+    if len(data) == limit:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(data[-1]["_id"] if raw else data[-1].id)
+    if raw:
+        # stored tasks were validated when written, skip the response_model validation and encode with orjson
+        return ORJSONResponse(data,headers=headers)
+    if query_fields:
+        return JSONResponse([projectTask(task,query_fields) for task in data],headers=headers)
+    response.headers.update(headers)
+    return data
+
+@task_router.get("/export",response_class=StreamingResponse)
+async def exportTasks(status: Optional[Status] = None, conn=Depends(get_db_connection),current_user: Principal = Security(get_current_active_user, scopes=["task:read"])):
+    """Route to stream every task of the current user as NDJSON, one task per line
+
+    rows are written as the cursor is read, memory stays flat whatever the number of tasks
+    """
     task_filters = {"userId": current_user.username}
     if status:
         task_filters["status"] = status
 
-    data = crud.get_all(conn.db,task_filters,skip,limit)
+    async def rows():
+        lines = []
+        async for task in crud.iter_all(conn.db,task_filters,settings.export_batch_size):
+            lines.append(json.dumps(raw_task(task)))
+            if len(lines) >= settings.export_batch_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+    return StreamingResponse(rows(),media_type="application/x-ndjson")
+
+@task_router.get("/summary",response_model=TaskSummary)
+async def getTaskSummary(conn=Depends(get_db_connection),current_user: Principal = Security(get_current_active_user, scopes=["task:read"])):
+    """Route to count the tasks of the current user per status and per contributor
+
+    the cached summary is only served while the change counter of the user is the one read before
+    computing it, so writes of any route, hand-overs and writes served by other workers all retire it
+    """
+
+    version = await crud.get_version(conn.db,current_user.username)
+    cached = summary_cache.get(current_user.username)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    data = await crud.summary(conn.db,current_user.username)
+    summary_cache.set(current_user.username,(version,data))
     return data
 
+@task_router.get("/search",response_model=List[Tasks])
+async def searchTasks(q: str = Query(..., min_length=1, max_length=256), status: Optional[Status] = None, prefix: bool = True, skip: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=100), conn=Depends(get_db_connection),current_user: Principal = Security(get_current_active_user, scopes=["task:read"])):
+    """Route to search the tasks of the current user by title, most relevant first
+
+    every word of q must be a word of the title, the last one only has to start a word of the title
+    unless prefix is false or q ends with a space
+    """
+    return await crud.search(conn.db,current_user.username,q,status,prefix,skip,limit)
+
+@task_router.get("/events",response_class=StreamingResponse)
+async def streamTaskEvents(current_user: Principal = Security(get_current_active_user, scopes=["task:read"])):
+    """Route to stream the created, updated and deleted tasks of the current user as server-sent events
+
+    an idle stream gets a keep-alive comment every task_events_keepalive seconds. A client that falls
+    behind gets a resync event and the stream ends, it should list its tasks again and resubscribe
+    """
+
+    async def events():
+        subscription = task_events.subscribe(current_user.username)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                event = await subscription.get(settings.task_events_keepalive)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield serverSentEvent(event)
+                if event.type == TaskEventType.RESYNC:
+                    task_events.resyncs += 1
+                    return
+        finally:
+            task_events.unsubscribe(subscription)
+
+    return StreamingResponse(events(),media_type="text/event-stream",headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @task_router.get("/{task_id}",response_model=Tasks)
-async def getTask(task_id:str, conn=Depends(DbConnection), current_user: Users = Security(get_current_active_user, scopes=["task:read"])):
-    """Route to return all the tasks from db"""
+async def getTask(request: Request, response: Response, task_id:str, fields: Optional[str] = FIELDS_QUERY, conn=Depends(get_db_connection), current_user: Principal = Security(get_current_active_user, scopes=["task:read"])):
+    """Route to return a task from db, limited to the selected fields when fields is given
 
-    data = crud.get_by_id(conn.db,task_id)
-    isUserCanAccessTask(data,current_user)
+    carries an ETag like getAllTasks, a matching If-None-Match gets a 304 without reading the task.
+    Contributors can read the task too, without an ETag since the counter of the owner changes with it
+    """
+
+    query_fields = parseTaskFields(fields)
+    etag = await taskEtag(request,conn.db,current_user)
+    # * only matches a task that exists and may be read, it is checked once the task is
+    if etagMatches(request,etag,wildcard=False):
+        return Response(status_code=304,headers={"ETag": etag})
+    data = await crud.get_by_id(conn.db,task_id,query_fields)
+    isUserCanAccessTask(data,current_user,read=True)
     if not data:
         raise HTTPException(status_code=404,detail=TASK_NOT_FOUND_MSG)
-    
+    headers = {"ETag": etag} if data.userId == current_user.username else {}
+    if etagMatches(request,etag):
+        return Response(status_code=304,headers=headers)
+    if query_fields:
+        return JSONResponse(projectTask(data,query_fields),headers=headers)
+    response.headers.update(headers)
     return data
 
 @task_router.post("",response_model=Tasks, status_code=201)
-async def createTask(payload: Tasks, conn=Depends(DbConnection),current_user: Users = Security(get_current_active_user, scopes=["task:write"])):
-    """Route to return all the tasks from db"""
+async def createTask(payload: Tasks, conn=Depends(get_db_connection),current_user: Principal = Security(get_current_active_user, scopes=["task:write"])):
+    """Route to create a task owned by the current user"""
     
     #set current user as creator of the task
     payload.userId = current_user.username
-    # create the task
-    inserted_data = crud.create(conn.db,payload)
-
-    if inserted_data.inserted_id:
-        #fetch and return the created task
-        data = crud.get_by_id(conn.db,inserted_data.inserted_id)
-    else:
+    # create the task, the created task is returned without reading it back
+    data = await crud.create(conn.db,payload)
+    await publishTaskEvents(TaskEventType.CREATED,current_user,[data.dict(by_alias=True)])
+    if not data.id:
         raise HTTPException(status_code=404,detail=TASK_NOT_FOUND_MSG)
     
     return data
 
 @task_router.put("/update/{task_id}",response_model=Tasks)
-async def updateTask(task_id:str ,payload: Tasks, conn=Depends(DbConnection),current_user: Users = Security(get_current_active_user, scopes=["task:write"])):
-    """Route to return all the tasks from db"""
+async def updateTask(task_id:str ,payload: Tasks, conn=Depends(get_db_connection),current_user: Principal = Security(get_current_active_user, scopes=["task:write"])):
+    """Route to update a task of the current user"""
 
-    #get the task
-    task = crud.get_by_id(conn.db,task_id)
-    isUserCanAccessTask(task,current_user)
-    # update the task
-    data = crud.update_by_id(conn.db,task_id,payload)
-    if data.matched_count:
-    #fetch and return the created task
-        data = crud.get_by_id(conn.db,task_id)
-    else:
-        raise HTTPException(status_code=404,detail=TASK_NOT_FOUND_MSG)
+    # update the task, scoped to the current user, and get the updated task back
+    data = await crud.update_by_id(conn.db,task_id,payload,current_user.username)
+    if not data:
+        await raiseTaskWriteError(conn.db,task_id,current_user)
+    await publishTaskEvents(TaskEventType.UPDATED,current_user,[data.dict(by_alias=True)])
     return data
 
 @task_router.delete("/delete/{task_id}")
-async def removeTask(task_id:str, conn=Depends(DbConnection),current_user: Users = Security(get_current_active_user, scopes=["task:write"])):
-    """Route to return all the tasks from db"""
-    
-    task = crud.get_by_id(conn.db,task_id)
-    isUserCanAccessTask(task,current_user)
+async def removeTask(task_id:str, conn=Depends(get_db_connection),current_user: Principal = Security(get_current_active_user, scopes=["task:write"])):
+    """Route to delete a task of the current user"""
 
-    # remove the task
-    deleted_count = crud.remove_by_id(conn.db,task_id)
+    # remove the task, scoped to the current user
+    deleted_count = await crud.remove_by_id(conn.db,task_id,current_user.username)
     if not deleted_count:
-        raise HTTPException(status_code=404,detail=TASK_NOT_FOUND_MSG)
+        await raiseTaskWriteError(conn.db,task_id,current_user)
+    await publishTaskEvents(TaskEventType.DELETED,current_user,[{"_id": task_id}])
     
     return JSONResponse(status_code=200, content={
         "message": DELETED_TASK_MSG.format(task_id)
     })
 
-def isUserCanAccessTask(task, current_user):
-    if task and task.userId != current_user.username:
-        raise HTTPException(status_code=401,detail="Unauthorized access to data")
-    return True
\ No newline at end of file
+@task_router.post("/bulk",response_model=BulkTaskResponse)
+async def createTasks(payload: BulkTaskRequest, conn=Depends(get_db_connection),current_user: Principal = Security(get_current_active_user, scopes=["task:write"])):
+    """Route to create many tasks of the current user with one batched write"""
+
+    checkBulkSize(payload.items)
+    valid, results = parseBulkItems(payload.items,Tasks.parse_obj,payload.ordered)
+    for _, task in valid:
+        task.userId = current_user.username
+
+    tasks, errors = await crud.create_many(conn.db,[task for _, task in valid],payload.ordered)
+    await publishTaskEvents(TaskEventType.CREATED,current_user,[task.dict(by_alias=True) for task in tasks if task])
+    for position, (index, _) in enumerate(valid):
+        if position in errors:
+            results.append(failedBulkItem(index,errors[position]))
+        else:
+            results.append(BulkItemResult(index=index,status=BulkItemStatus.CREATED,id=tasks[position].id))
+    return BulkTaskResponse(results=sorted(results,key=lambda result: result.index))
+
+@task_router.put("/bulk/update",response_model=BulkTaskResponse)
+async def updateTasks(payload: BulkTaskRequest, conn=Depends(get_db_connection),current_user: Principal = Security(get_current_active_user, scopes=["task:write"])):
+    """Route to update many tasks of the current user with one batched write, every item carries its _id"""
+
+    checkBulkSize(payload.items)
+    valid, results = parseBulkItems(payload.items,parseTaskUpdate,payload.ordered)
+
+    updated, errors = await crud.update_many(conn.db,[task for _, task in valid],current_user.username,payload.ordered)
+    await publishTaskEvents(TaskEventType.UPDATED,current_user,[task.dict(by_alias=True) for task in updated.values()])
+    for position, (index, task) in enumerate(valid):
+        if position in errors:
+            results.append(failedBulkItem(index,errors[position]))
+        elif task.id in updated:
+            results.append(BulkItemResult(index=index,status=BulkItemStatus.UPDATED,id=task.id))
+        else:
+            results.append(BulkItemResult(index=index,status=BulkItemStatus.NOT_FOUND,id=task.id,error=TASK_NOT_FOUND_MSG))
+    return BulkTaskResponse(results=sorted(results,key=lambda result: result.index))
+
+@task_router.delete("/bulk/delete",response_model=BulkTaskResponse)
+async def removeTasks(payload: BulkTaskDeleteRequest, conn=Depends(get_db_connection),current_user: Principal = Security(get_current_active_user, scopes=["task:write"])):
+    """Route to delete many tasks of the current user with one batched write"""
+
+    checkBulkSize(payload.items)
+    valid, results = parseBulkItems(payload.items,taskIdParser(),payload.ordered)
+
+    deleted = await crud.remove_many(conn.db,[task_id for _, task_id in valid],current_user.username)
+    await publishTaskEvents(TaskEventType.DELETED,current_user,[{"_id": task_id} for task_id in deleted])
+    for index, task_id in valid:
+        if task_id in deleted:
+            results.append(BulkItemResult(index=index,status=BulkItemStatus.DELETED,id=task_id))
+        else:
+            results.append(BulkItemResult(index=index,status=BulkItemStatus.NOT_FOUND,id=task_id,error=TASK_NOT_FOUND_MSG))
+    return BulkTaskResponse(results=sorted(results,key=lambda result: result.index))
+
+async def taskEtag(request: Request, db, current_user):
+    """strong ETag of a task read, the change counter of the user plus everything picking the representation
+
+    the counter is read before the tasks and bumped after every write, so an ETag never outlives the data it was sent with
+    """
+    version = await crud.get_version(db,current_user.username)
+    representation = f"{current_user.username}\n{request.url.path}\n{request.url.query}\n{settings.fast_responses}"
+    return '"%d-%s"' % (version,hashlib.blake2b(representation.encode(),digest_size=8).hexdigest())
+
+def etagMatches(request: Request, etag: str, wildcard: bool=True):
+    """If-None-Match check of the request, compared weakly as RFC 7232 asks for GET
+
+    wildcard tells whether * matches, it must only when a current representation exists
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return wildcard
+    return any(tag.strip().replace("W/","",1) == etag for tag in if_none_match.split(","))
+
+async def publishTaskEvents(event_type: str, current_user, tasks: List[dict]):
+    """Called with the tasks a write applied, notifies the subscribers of the current user and of the task owners"""
+    await task_events.publish(TaskEvent(event_type,(current_user.username,task.get("userId")),task) for task in tasks)
+
+def serverSentEvent(event: TaskEvent):
+    return f"event: {event.type}\ndata: {json.dumps(event.task)}\n\n"
+
+def checkBulkSize(items):
+    if len(items) > settings.max_bulk_size:
+        raise HTTPException(status_code=413,detail=BULK_TOO_LARGE_MSG.format(settings.max_bulk_size))
+
+def parseBulkItems(items, parse, ordered: bool):
+    """Validate every item on its own, returns [(index, parsed item)] to write and the results of the rejected items"""
+    valid, results = [], []
+    for index, item in enumerate(items):
+        if ordered and results:
+            results.append(BulkItemResult(index=index,status=BulkItemStatus.SKIPPED,error=BULK_SKIPPED_MSG))
+            continue
+        try:
+            valid.append((index, parse(item)))
+        except ValueError as error:
+            results.append(BulkItemResult(index=index,status=BulkItemStatus.INVALID,error=str(error)))
+    return valid, results
+
+def parseTaskUpdate(item):
+    task = Tasks.parse_obj(item)
+    if not task.id:
+        raise ValueError("_id is required to update a task")
+    task.id = normalTaskId(task.id)
+    return task
+
+def taskIdParser():
+    """Parser of the ids of a bulk delete, every id may appear once"""
+    seen = set()
+    def parse(item):
+        task_id = normalTaskId(PyObjectId.validate(item))
+        if task_id in seen:
+            raise ValueError(BULK_DUPLICATE_ID_MSG.format(task_id))
+        seen.add(task_id)
+        return task_id
+    return parse
+
+def normalTaskId(task_id: str):
+    """ids are hex strings in any case, the crud results are keyed by str(ObjectId) which is lowercase"""
+    return str(ObjectId(task_id))
+
+def failedBulkItem(index, error):
+    status = BulkItemStatus.SKIPPED if error == BULK_SKIPPED_MSG else BulkItemStatus.FAILED
+    return BulkItemResult(index=index,status=status,error=error)
+
+async def raiseTaskWriteError(db, task_id, current_user):
+    """An owner scoped write matched nothing, tell a task of another user (401) from a missing one (404)"""
+    task = await crud.get_by_id(db,task_id)
+    isUserCanAccessTask(task,current_user)
+    raise HTTPException(status_code=404,detail=TASK_NOT_FOUND_MSG)
+
+def parseTaskFields(fields: Optional[str]):
+    """Split and validate the fields query parameter, None selects whole tasks"""
+    if not fields:
+        return None
+    requested = list(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    unknown = [field for field in requested if field not in TASK_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=422,detail=UNKNOWN_TASK_FIELDS_MSG.format(", ".join(unknown),", ".join(TASK_FIELDS)))
+    return requested or None
+
+def projectTask(task: TaskFields, fields):
+    """json ready task holding _id and the selected fields only"""
+    return task.dict(by_alias=True,include={"id",*fields})
+
+def isUserCanAccessTask(task, current_user, read: bool=False):
+    """Only the owner writes a task, its contributors may also read it"""
+    if not task or task.userId == current_user.username:
+        return True
+    if read and current_user.username in (task.contributors or []):
+        return True
+    raise HTTPException(status_code=401,detail="Unauthorized access to data")
\ No newline at end of file
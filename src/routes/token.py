@@ -1,15 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from src.database.connection import DbConnection
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from src.admission import enforce_rate_limit
+from src.database.connection import get_db_connection, get_user_crud
 from src.config.config import Settings
-from src.database.crud import MongoUserCrud
-from passlib.hash import sha256_crypt
+from src.passwords import PasswordPoolSaturated, password_pool
+from src.routes.users import principal_cache
 from jose import jwt
 from fastapi.security import (OAuth2PasswordRequestForm)
-from src.constants import USER_NOT_FOUND_MSG
+from src.constants import USER_NOT_FOUND_MSG, PASSWORD_POOL_BUSY_MSG
 
 
 settings = Settings.get_settings()
-crud = MongoUserCrud()
+crud = get_user_crud()
 
 token_router = APIRouter(
     prefix="/api/v1/token",
@@ -20,15 +21,20 @@ token_router = APIRouter(
         }
     })
 
-def verify_password(plain_password: str, hashed_password: str):
+async def verify_password(plain_password: str, hashed_password: str):
     """
-    verify password compares plain_password with hashed password
+    verify password compares plain_password with hashed password on the password worker pool
     :param plain_password: plain password of type string
     :param hashed_password: hashed password of type string
+    :return: whether the password matches and the upgraded hash if the stored one is outdated
     """
-    return sha256_crypt.verify(plain_password, hashed_password)
+    try:
+        return await password_pool.verify_and_update(plain_password, hashed_password)
+    except PasswordPoolSaturated as error:
+        raise HTTPException(
+            status_code=503, detail=PASSWORD_POOL_BUSY_MSG, headers={"Retry-After": "1"}) from error
 
-def authenticate_user(db, username: str, password: str, scopes: list):
+async def authenticate_user(db, username: str, password: str, scopes: list):
     """
     This function authenticates user based on username and password
     :param db: refers to current database object
@@ -36,10 +42,15 @@ def authenticate_user(db, username: str, password: str, scopes: list):
     :param password: password of type string
     :param scopes: list of user permissions
     """
-    user = crud.get_by_name(db, username)
-    if not (user and verify_password(password, user.hashed_password)):
+    user = await crud.get_by_name(db, username)
+    verified, new_hash = await verify_password(password, user.hashed_password) if user else (False, None)
+    if not verified:
         raise HTTPException(
             status_code=400, detail="Incorrect username or password")
+    if new_hash:
+        # transparently move the stored hash to the current scheme and rounds
+        await crud.update_password(db, username, new_hash)
+        principal_cache.invalidate(username)
     for scope in scopes:
         if scope not in user.scopes:
             raise HTTPException(status_code=401, detail="Unauthorized")
@@ -57,14 +68,17 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 @token_router.post("")
-async def login_for_access_token(conn=Depends(DbConnection),
+async def login_for_access_token(request: Request, conn=Depends(get_db_connection),
                                  form_data: OAuth2PasswordRequestForm = Depends()):
     """
-    This function authenticates the user and returns access token
+    This function authenticates the user and returns access token, logins are rate limited per username
+    :param request: the login request, its path selects the route group
     :param conn: dependency injection to share database connection
     :param form_data: OAuth2 compatible token login, get an access token for future requests
     """
-    user = authenticate_user(conn.db, form_data.username, form_data.password, form_data.scopes)
+    if settings.admission_enabled:
+        enforce_rate_limit(request.scope, form_data.username)
+    user = await authenticate_user(conn.db, form_data.username, form_data.password, form_data.scopes)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
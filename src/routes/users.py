@@ -1,18 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Security
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status, Security
 from fastapi.security import (OAuth2PasswordBearer, SecurityScopes)
 from fastapi.responses import JSONResponse
-from src.database.connection import DbConnection
-from src.database.crud import MongoUserCrud
-from src.models.schemas import Users, TokenData, UserCreate, UsersResponse
-from src.constants import ALL_SCOPES, DELETED_USER_MSG, USER_NOT_FOUND_MSG
+from src.admission import enforce_rate_limit
+from src.cache import TTLCache
+from src.database.connection import get_db_connection, get_user_crud
+from src.database.crud import user_filter
+from src.database.pagination import decode_key_cursor, encode_key_cursor
+from src.models.schemas import AuthScopeEnum, Principal, TokenData, UserCreate, UsersResponse
+from src.constants import ALL_SCOPES, DELETED_USER_MSG, USER_NOT_FOUND_MSG, PASSWORD_POOL_BUSY_MSG, INVALID_CURSOR_MSG, NEXT_CURSOR_HEADER
 from src.config.config import Settings
+from src.passwords import PasswordPoolSaturated, password_pool
 from jose import JWTError, jwt
-from typing import List
-from passlib.hash import sha256_crypt
+from typing import List, Optional
 
 settings = Settings.get_settings()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", scopes=ALL_SCOPES)
-crud = MongoUserCrud()
+crud = get_user_crud()
+# username -> Principal resolved by get_current_user, invalidated whenever the user changes
+principal_cache = TTLCache(settings.principal_cache_size, settings.principal_cache_ttl)
 
 users_router = APIRouter(
     prefix="/api/v1/users",
@@ -25,9 +30,10 @@ users_router = APIRouter(
     }
 )
 
-async def get_current_user(security_scopes: SecurityScopes, conn=Depends(DbConnection), token: str = Depends(oauth2_scheme)):
+async def get_current_user(request: Request, security_scopes: SecurityScopes, conn=Depends(get_db_connection), token: str = Depends(oauth2_scheme)):
     """
-    This function gets and validates user
+    This function gets and validates user, then takes a token of its rate limit in the route group of the request
+    :param request: the request, its path selects the route group
     :param security_scopes: of type SecurityScopes that is list containing all scopes
     required by itself and all dependencies that use this as sub-dependency
     :param conn: dependency injection to share database connection
@@ -51,9 +57,14 @@ async def get_current_user(security_scopes: SecurityScopes, conn=Depends(DbConne
     except JWTError as error:
         raise credentials_exception from error
     
-    user = crud.get_by_name(conn.db,username)
-    if not user:
-        raise credentials_exception
+    user = principal_cache.get(username)
+    if user is None:
+        # a user deleted or changed while the lookup is in flight must not be cached again
+        generation = principal_cache.generation
+        user = await crud.get_principal(conn.db,username)
+        if not user:
+            raise credentials_exception
+        principal_cache.set(username, user, generation)
     for scope in security_scopes.scopes:
         if scope not in token_data.scopes:
             raise HTTPException(
@@ -61,12 +72,14 @@ async def get_current_user(security_scopes: SecurityScopes, conn=Depends(DbConne
                     detail="Not enough permissions",
                     headers={"WWW-Authenticate": authenticate_value}
                 )
+    if settings.admission_enabled:
+        enforce_rate_limit(request.scope, username)
     return user
     
     
 
 
-async def get_current_active_user(current_user: Users = Depends(get_current_user)):
+async def get_current_active_user(current_user: Principal = Depends(get_current_user)):
     """
     This function provides current user
     :param: current_user: security dependency on get_current_user
@@ -77,58 +90,84 @@ async def get_current_active_user(current_user: Users = Depends(get_current_user
     return current_user
 
 @users_router.get("", response_model=List[UsersResponse])
-async def getUser(conn=Depends(DbConnection), admin_user: Users = Security(get_current_active_user, scopes=["admin:user"])):
+async def getUsers(response: Response, scopes: Optional[List[AuthScopeEnum]] = Query(None), active: Optional[bool] = None, created_by: Optional[str] = None,
+                   skip: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000), cursor: Optional[str] = None,
+                   conn=Depends(get_db_connection), admin_user: Principal = Security(get_current_active_user, scopes=["admin:user"])):
     """
-    This function reads current user based on GET call
-    :param current_user: dependency on get_current_active_user
+    This function reads a page of users ordered by username based on GET call
+    A full page carries an opaque cursor in the X-Next-Cursor header, pass it back as cursor to continue after it
+    :param scopes: only users having every given scope
+    :param active: only active or only disabled users
+    :param created_by: only users created by this admin
+    :param conn: dependency injection to share database connection
+    :param admin_user: dependency on get_current_active_user
     """
-    users = crud.get_all(conn.db)
+    try:
+        after = decode_key_cursor(cursor) if cursor else None
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=INVALID_CURSOR_MSG) from error
+
+    scopes = [scope.value for scope in scopes] if scopes else None
+    users = await crud.get_all(conn.db, user_filter(scopes, active, created_by), skip, limit, after)
+    if len(users) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_key_cursor(users[-1].username)
     return users
 
 @users_router.get("/me", response_model=UsersResponse)
-async def getUser(current_user: Users = Depends(get_current_active_user)):
+async def getUser(conn=Depends(get_db_connection), current_user: Principal = Depends(get_current_active_user)):
     """
     This function reads current user based on GET call
+    :param conn: dependency injection to share database connection
     :param current_user: dependency on get_current_active_user
     """
 
-    return current_user
+    user = await crud.get_by_name(conn.db, current_user.username)
+    if not user:
+        raise HTTPException(status_code=404, detail=USER_NOT_FOUND_MSG)
+    return user
 
 def hash_password(password):
     """
-    hash password method which encrypts the password using SHA256-Crypt password hash
+    hash password method which encrypts the password with the first configured password scheme
+    in the calling process, routes use password_pool.hash to keep the event loop free
     :param password: password
     """
-    return sha256_crypt.hash(password)
+    return password_pool.hash_sync(password)
 
 @users_router.post("", response_model=UsersResponse)
-async def create_user(user: UserCreate, conn=Depends(DbConnection), admin_user: Users = Security(get_current_active_user, scopes=["admin:user"])):
+async def create_user(user: UserCreate, conn=Depends(get_db_connection), admin_user: Principal = Security(get_current_active_user, scopes=["admin:user"])):
     """
     This function creates user based on POST call
     :param user: data class of user create type listing all the parameters required
     :param conn: dependency injection to share database connection
     """
-    old_user = crud.get_by_name(conn.db, user.username)
+    old_user = await crud.get_by_name(conn.db, user.username)
     if old_user:
         raise HTTPException(
             status_code=400, detail="User already exists")
 
-    user.hashed_password = hash_password(user.password)
+    try:
+        user.hashed_password = await password_pool.hash(user.password)
+    except PasswordPoolSaturated as error:
+        raise HTTPException(
+            status_code=503, detail=PASSWORD_POOL_BUSY_MSG, headers={"Retry-After": "1"}) from error
 
     #set the create_by and create the new user
     user.created_by = admin_user.username
-    new_user = crud.create(conn.db, user)
+    new_user = await crud.create(conn.db, user)
+    principal_cache.invalidate(user.username)
     if new_user.inserted_id:
-        return crud.get_by_id(conn.db, str(new_user.inserted_id))
+        return await crud.get_by_id(conn.db, str(new_user.inserted_id))
 
 @users_router.delete("/delete/{username}", response_model=UsersResponse)
-async def delete_user(username: str, conn=Depends(DbConnection), admin_user: Users = Security(get_current_active_user, scopes=["admin:user"])):
+async def delete_user(username: str, conn=Depends(get_db_connection), admin_user: Principal = Security(get_current_active_user, scopes=["admin:user"])):
     """
     This function delete user based on POST call
     :param user: userId a type of ObjectId string
     :param conn: dependency injection to share database connection
     """
-    old_user_deleted_count = crud.remove_by_name(conn.db, username)
+    old_user_deleted_count = await crud.remove_by_name(conn.db, username)
+    principal_cache.invalidate(username)
     if old_user_deleted_count:
             return JSONResponse(status_code=200, content={
             "message": DELETED_USER_MSG.format(username)
@@ -0,0 +1,92 @@
+# Single-flight coalescing, concurrent identical reads share one query
+
+import asyncio
+import functools
+
+
+class Flight:
+    """ A query in flight and the number of callers awaiting it """
+
+    __slots__ = ("task", "loop", "waiters")
+
+    def __init__(self, task: asyncio.Task, loop):
+        self.task = task
+        self.loop = loop
+        self.waiters = 0
+
+
+class SingleFlight:
+    """ Runs one query per key at a time, callers asking for a key already in flight await the same query
+
+    every caller gets the result, or the exception, of the shared query, so results must be treated
+    as read-only. A cancelled caller only stops waiting, the query is cancelled once nobody waits on it.
+    Writes call forget so reads issued after them never join a query started before them.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.calls = 0
+        self.executed = 0
+        self.shared = 0
+        self._flights = {}
+
+    async def do(self, key, query):
+        """result of query(), shared with the concurrent callers of the same key"""
+        if not self.enabled:
+            return await query()
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        flight = self._flights.get(key)
+        if flight is None or flight.loop is not loop:
+            flight = Flight(loop.create_task(query()), loop)
+            self._flights[key] = flight
+            flight.task.add_done_callback(functools.partial(self._landed, key, flight))
+            self.executed += 1
+        else:
+            self.shared += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _landed(self, key, flight: Flight, task: asyncio.Task):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not task.cancelled():
+            # retrieved here so a query whose callers all gave up doesn't log an unretrieved exception
+            task.exception()
+
+    def forget(self):
+        """start new queries for the next reads, queries in flight still answer their callers"""
+        self._flights.clear()
+
+    def stats(self):
+        """calls, queries executed for them and calls served by a query already in flight"""
+        return {"calls": self.calls, "executed": self.executed, "shared": self.shared, "in_flight": len(self._flights)}
+
+
+def _frozen(value):
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_frozen(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _frozen(item)) for key, item in value.items()))
+    return value
+
+
+def coalesced(flight: SingleFlight):
+    """decorate an async crud read method taking the db first, identical concurrent calls share one query"""
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, db, *args, **kwargs):
+            key = (method.__qualname__, _frozen(args), _frozen(kwargs))
+            return await flight.do(key, lambda: method(self, db, *args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+from src.admission import ConcurrencyLimiter, Overloaded, RateLimiter, route_group
+
+
+class FakeClock:
+    """Manually advanced clock for refilling token buckets"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAdmission:
+    """Test class for the concurrency and rate limiters of the route groups"""
+
+    def test_queue_hands_over_slots_in_order(self):
+        """This method test waiting requests get the freed slots first come first served"""
+        async def scenario():
+            limiter = ConcurrencyLimiter(limit=1, queue_size=2, queue_timeout=1)
+            await limiter.acquire()
+            order = []
+
+            async def request(name):
+                await limiter.acquire()
+                order.append(name)
+                limiter.release()
+
+            waiting = [asyncio.create_task(request("first")), asyncio.create_task(request("second"))]
+            await asyncio.sleep(0)
+            assert limiter.waiting() == 2
+            limiter.release()
+            await asyncio.gather(*waiting)
+            assert order == ["first", "second"]
+            assert limiter.active == 0
+
+        asyncio.run(scenario())
+
+    def test_sheds_when_queue_full_or_timed_out(self):
+        """This method test a request is shed instead of waiting without bound"""
+        async def scenario():
+            limiter = ConcurrencyLimiter(limit=1, queue_size=1, queue_timeout=0.01)
+            await limiter.acquire()
+            waiter = asyncio.create_task(limiter.acquire())
+            await asyncio.sleep(0)
+            with pytest.raises(Overloaded):
+                await limiter.acquire()
+            with pytest.raises(Overloaded):
+                await waiter
+            assert limiter.stats()["shed"] == 2
+            assert limiter.waiting() == 0
+            limiter.release()
+            assert limiter.active == 0
+
+        asyncio.run(scenario())
+
+    def test_release_while_timed_out_waiter_unwinds(self):
+        """This method test a waiter skipped by a release as it times out is still shed with Overloaded"""
+        async def scenario():
+            limiter = ConcurrencyLimiter(limit=1, queue_size=1, queue_timeout=0.01)
+            await limiter.acquire()
+            waiter = asyncio.create_task(limiter.acquire())
+            await asyncio.sleep(0)
+            # the timeout cancels the waiter, a release runs before the acquire unwinds and pops it
+            limiter._waiters[0].add_done_callback(lambda _: limiter.release())
+            with pytest.raises(Overloaded):
+                await waiter
+            assert limiter.waiting() == 0
+            assert limiter.active == 0
+
+        asyncio.run(scenario())
+
+    def test_token_bucket(self):
+        """This method test a principal gets its burst, then the refill rate, independently of the others"""
+        clock = FakeClock()
+        limiter = RateLimiter(rate=2, burst=2, max_keys=10, clock=clock)
+        assert limiter.acquire("user") == 0
+        assert limiter.acquire("user") == 0
+        assert limiter.acquire("user") == pytest.approx(0.5)
+        assert limiter.acquire("other") == 0
+        clock.now = 0.5
+        assert limiter.acquire("user") == 0
+        assert limiter.limited == 1
+
+    def test_route_group(self):
+        """This method test requests are grouped by the router they hit"""
+        assert route_group({"path": "/api/v1/tasks/summary"}) == "tasks"
+        assert route_group({"path": "/base/api/v1/token", "root_path": "/base"}) == "token"
+        assert route_group({"path": "/api/v1/tasksx"}) is None
+        assert route_group({"path": "/metrics"}) is None
@@ -0,0 +1,91 @@
+import asyncio
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError, DuplicateKeyError
+from src.database.batching import InsertBatcher
+
+
+class FakeCollection:
+    """Collection recording insert_many calls, failing the documents whose title is in fail"""
+
+    def __init__(self, fail=(), error=None):
+        self.batches = []
+        self.fail = fail
+        self.error = error
+
+    async def insert_many(self, documents, ordered):
+        assert not ordered
+        if self.error:
+            raise self.error
+        self.batches.append(documents)
+        write_errors = [{"index": index, "code": 11000, "errmsg": "duplicate key"}
+                        for index, document in enumerate(documents) if document["title"] in self.fail]
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors})
+
+
+class FakeDB(dict):
+    def __init__(self, collection):
+        super().__init__(tasks=collection)
+
+
+class TestInsertBatcher:
+    """Test class for the micro-batching of task creates"""
+
+    def test_concurrent_inserts_share_one_write(self):
+        """This method test creates within the window are written together and each caller gets its own outcome"""
+        async def scenario():
+            collection = FakeCollection(fail=("duplicate",))
+            flushed = []
+
+            async def after_flush(db, documents):
+                flushed.append([document["title"] for document in documents])
+
+            batcher = InsertBatcher("tasks", window=0.01, max_size=10, after_flush=after_flush)
+            db = FakeDB(collection)
+            results = await asyncio.gather(*(batcher.insert(db, {"title": title}) for title in ["a", "duplicate", "b"]),
+                                           return_exceptions=True)
+            assert results[0] is None and results[2] is None
+            assert isinstance(results[1], DuplicateKeyError)
+            assert len(collection.batches) == 1
+            assert flushed == [["a", "b"]]
+            assert batcher.stats() == {"batches": 1, "documents": 3, "failed": 1}
+
+        asyncio.run(scenario())
+
+    def test_max_size_flushes_without_waiting(self):
+        """This method test a full batch is written right away and the next creates start a new one"""
+        async def scenario():
+            collection = FakeCollection()
+            batcher = InsertBatcher("tasks", window=60, max_size=2)
+            db = FakeDB(collection)
+            await asyncio.wait_for(asyncio.gather(*(batcher.insert(db, {"title": str(index)}) for index in range(4))), 1)
+            assert [len(batch) for batch in collection.batches] == [2, 2]
+
+        asyncio.run(scenario())
+
+    def test_failed_batch_fails_every_caller(self):
+        """This method test a server error reaches every caller of the batch"""
+        async def scenario():
+            batcher = InsertBatcher("tasks", window=0.01, max_size=10)
+            db = FakeDB(FakeCollection(error=AutoReconnect("down")))
+            results = await asyncio.gather(*(batcher.insert(db, {"title": "a"}) for _ in range(2)), return_exceptions=True)
+            assert all(isinstance(result, AutoReconnect) for result in results)
+
+        asyncio.run(scenario())
+
+    def test_cancelled_caller_withdraws_its_document(self):
+        """This method test a caller cancelled before the batch is sent is not written"""
+        async def scenario():
+            collection = FakeCollection()
+            batcher = InsertBatcher("tasks", window=0.02, max_size=10)
+            db = FakeDB(collection)
+            cancelled = asyncio.create_task(batcher.insert(db, {"title": "cancelled"}))
+            kept = asyncio.create_task(batcher.insert(db, {"title": "kept"}))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            await kept
+            with pytest.raises(asyncio.CancelledError):
+                await cancelled
+            assert [[document["title"] for document in batch] for batch in collection.batches] == [["kept"]]
+
+        asyncio.run(scenario())
@@ -0,0 +1,78 @@
+from src.cache import TTLCache
+
+
+class FakeClock:
+    """Manually advanced clock for expiring cache entries"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache:
+    """Test class for the TTL/LRU cache used by the auth path"""
+
+    def test_hit_and_miss(self):
+        """This method test the cached value is returned and counted"""
+        cache = TTLCache(max_size=2, ttl=10)
+        assert cache.get("user") is None
+        cache.set("user", "principal")
+        assert cache.get("user") == "principal"
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_expiry(self):
+        """This method test entries are dropped once their ttl is over"""
+        clock = FakeClock()
+        cache = TTLCache(max_size=2, ttl=10, clock=clock)
+        cache.set("user", "principal")
+        clock.now = 10
+        assert cache.get("user") is None
+        assert cache.stats()["size"] == 0
+
+    def test_lru_eviction(self):
+        """This method test the least recently used entry is evicted when the cache is full"""
+        cache = TTLCache(max_size=2, ttl=10)
+        cache.set("first", 1)
+        cache.set("second", 2)
+        cache.get("first")
+        cache.set("third", 3)
+        assert cache.get("second") is None
+        assert cache.get("first") == 1
+        assert cache.get("third") == 3
+        assert cache.stats()["evictions"] == 1
+
+    def test_invalidate(self):
+        """This method test an invalidated entry is no longer served"""
+        cache = TTLCache(max_size=2, ttl=10)
+        cache.set("user", "principal")
+        cache.invalidate("user")
+        assert cache.get("user") is None
+
+    def test_disabled(self):
+        """This method test a cache without room stores nothing"""
+        cache = TTLCache(max_size=0, ttl=10)
+        cache.set("user", "principal")
+        assert cache.get("user") is None
+
+    def test_set_after_invalidation_is_dropped(self):
+        """This method test a value looked up before an invalidation of its key is not cached"""
+        cache = TTLCache(max_size=1, ttl=10)
+        generation = cache.generation
+        cache.invalidate("user")
+        cache.set("user", "deleted principal", generation)
+        assert cache.get("user") is None
+
+        generation = cache.generation
+        cache.invalidate("other")
+        cache.set("user", "principal", generation)
+        assert cache.get("user") == "principal"
+
+        # "user" falls out of the invalidation log, its invalidation is still accounted for
+        generation = cache.generation
+        cache.invalidate("user")
+        cache.invalidate("other")
+        cache.set("user", "deleted principal", generation)
+        assert cache.get("user") is None
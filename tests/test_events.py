@@ -0,0 +1,55 @@
+import asyncio
+from pymongo.errors import AutoReconnect
+from src.events import EventBroker, MongoFanOut, TaskEvent, TaskEventType
+
+
+class FailingCollection:
+    """Collection whose inserts fail like an unreachable mongo"""
+
+    async def insert_one(self, document):
+        raise AutoReconnect("connection refused")
+
+
+class TestEventBroker:
+    """Test class for the in-process pub/sub of task events"""
+
+    def test_delivered_to_concerned_users(self):
+        """This method test an event reaches the subscribers of its users only"""
+        async def scenario():
+            broker = EventBroker(queue_size=8)
+            owner = broker.subscribe("owner")
+            other = broker.subscribe("other")
+            await broker.publish([TaskEvent(TaskEventType.CREATED, ("owner",), {"_id": "1", "title": "Task"})])
+            event = await owner.get(timeout=1)
+            assert event.type == TaskEventType.CREATED
+            assert event.task["title"] == "Task"
+            assert await other.get(timeout=0.01) is None
+            broker.unsubscribe(owner)
+            broker.unsubscribe(other)
+            assert broker.subscribers() == 0
+
+        asyncio.run(scenario())
+
+    def test_failed_fan_out_does_not_fail_the_write(self):
+        """This method test an event the mongo fan-out can't store is dropped instead of raising into the route"""
+        async def scenario():
+            fanout = MongoFanOut(lambda: {"task_events": FailingCollection()}, "task_events", 1024)
+            broker = EventBroker(queue_size=8, fanout=fanout)
+            broker._started = True
+            await broker.publish([TaskEvent(TaskEventType.CREATED, ("owner",), {"_id": "1"})])
+            assert broker.published == 1
+
+        asyncio.run(scenario())
+
+    def test_slow_subscriber_resyncs(self):
+        """This method test a subscriber whose queue is full is asked to resync instead of losing events silently"""
+        async def scenario():
+            broker = EventBroker(queue_size=2)
+            subscription = broker.subscribe("owner")
+            await broker.publish(TaskEvent(TaskEventType.UPDATED, ("owner",), {"_id": str(i)}) for i in range(5))
+            events = [await subscription.get(timeout=1), await subscription.get(timeout=1)]
+            assert events[0].type == TaskEventType.UPDATED
+            assert events[-1].type == TaskEventType.RESYNC
+            assert await subscription.get(timeout=0.01) is None
+
+        asyncio.run(scenario())
@@ -0,0 +1,140 @@
+import asyncio
+import pytest
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from src.database.crud import user_filter, visible_filter
+from src.database.memory import InMemoryDB, InMemoryTaskCrud, InMemoryUserCrud
+from src.models.schemas import Status, Tasks, Users
+
+task_crud = InMemoryTaskCrud()
+user_crud = InMemoryUserCrud()
+
+
+class TestInMemoryBackend:
+    """Test class for the indexed in-memory storage backend"""
+
+    @pytest.fixture
+    def db(self):
+        """This fixture provides an empty in-memory database"""
+        return InMemoryDB()
+
+    def create_tasks(self, db, user_id, count, status=Status.TODO):
+        payloads = [Tasks(title=f"Task {index}", userId=user_id, status=status) for index in range(count)]
+        created, errors = asyncio.run(task_crud.create_many(db, payloads))
+        assert not errors
+        return created
+
+    def test_get_all_uses_user_and_status_indexes(self, db):
+        """This method test listing is scoped to the user and status, ordered by _id"""
+        todo = self.create_tasks(db, "owner", 3)
+        done = self.create_tasks(db, "owner", 2, Status.DONE)
+        self.create_tasks(db, "other", 2)
+
+        tasks = asyncio.run(task_crud.get_all(db, {"userId": "owner"}))
+        assert [task.id for task in tasks] == [task.id for task in todo + done]
+        tasks = asyncio.run(task_crud.get_all(db, {"userId": "owner", "status": Status.DONE}))
+        assert [task.id for task in tasks] == [task.id for task in done]
+
+    def test_keyset_pagination(self, db):
+        """This method test skip/limit and continuing after an id"""
+        created = self.create_tasks(db, "owner", 5)
+        first_page = asyncio.run(task_crud.get_all(db, {"userId": "owner"}, limit=2))
+        second_page = asyncio.run(task_crud.get_all(db, {"userId": "owner"}, limit=2, after_id=ObjectId(first_page[-1].id)))
+        skipped_page = asyncio.run(task_crud.get_all(db, {"userId": "owner"}, skip=2, limit=2))
+        assert [task.id for task in second_page] == [task.id for task in created[2:4]]
+        assert [task.id for task in skipped_page] == [task.id for task in created[2:4]]
+
+    def test_update_moves_status_bucket(self, db):
+        """This method test an update re-indexes the task and is scoped to its owner"""
+        task = self.create_tasks(db, "owner", 1)[0]
+        payload = Tasks(title="Updated", status=Status.DONE)
+        assert asyncio.run(task_crud.update_by_id(db, task.id, payload, "other")) is None
+
+        updated = asyncio.run(task_crud.update_by_id(db, task.id, payload, "owner"))
+        assert updated.status == Status.DONE
+        assert asyncio.run(task_crud.get_all(db, {"userId": "owner", "status": Status.TODO})) == []
+        summary = asyncio.run(task_crud.summary(db, "owner"))
+        assert summary.status[Status.DONE] == 1 and summary.total == 1
+
+    def test_remove_is_owner_scoped(self, db):
+        """This method test deletes only remove tasks of the given owner"""
+        task = self.create_tasks(db, "owner", 1)[0]
+        assert asyncio.run(task_crud.remove_by_id(db, task.id, "other")) == 0
+        assert asyncio.run(task_crud.remove_by_id(db, task.id, "owner")) == 1
+        assert asyncio.run(task_crud.get_by_id(db, task.id)) is None
+        assert db.tasks.ids == []
+
+    def test_shared_view_merges_owner_and_contributor_indexes(self, db):
+        """This method test the shared view pages through owned and contributed tasks in _id order"""
+        payloads = [Tasks(title="Own", userId="owner"), Tasks(title="Shared", userId="other", contributors=["owner"]),
+                     Tasks(title="Both", userId="owner", contributors=["owner"]),
+                     Tasks(title="Done", userId="other", contributors=["owner"], status=Status.DONE),
+                     Tasks(title="Private", userId="other", contributors=["someone"])]
+        created, _ = asyncio.run(task_crud.create_many(db, payloads))
+        visible = [task.id for task in created[:4]]
+
+        filters = visible_filter("owner")
+        page = asyncio.run(task_crud.get_all(db, filters, limit=2))
+        assert [task.id for task in page] == visible[:2]
+        page = asyncio.run(task_crud.get_all(db, filters, limit=2, after_id=ObjectId(page[-1].id)))
+        assert [task.id for task in page] == visible[2:]
+        done = asyncio.run(task_crud.get_all(db, visible_filter("owner", Status.DONE)))
+        assert [task.id for task in done] == [visible[3]]
+
+        asyncio.run(task_crud.update_by_id(db, visible[1], Tasks(title="Shared", contributors=[])))
+        assert [task.id for task in asyncio.run(task_crud.get_all(db, filters))] == [visible[0], visible[2], visible[3]]
+
+    def test_unique_usernames(self, db):
+        """This method test usernames are unique like the users.username index"""
+        user = Users(username="owner", email="email", scopes=["task:read"])
+        inserted = asyncio.run(user_crud.create(db, user))
+        assert asyncio.run(user_crud.get_by_name(db, "owner")).username == "owner"
+        assert asyncio.run(user_crud.get_by_id(db, str(inserted.inserted_id))).username == "owner"
+        with pytest.raises(DuplicateKeyError):
+            asyncio.run(user_crud.create(db, user))
+
+    def test_principal_is_projected(self, db):
+        """This method test the principal only carries the fields authorization needs"""
+        asyncio.run(user_crud.create(db, Users(username="owner", email="email", scopes=["task:read"], active=False)))
+        principal = asyncio.run(user_crud.get_principal(db, "owner"))
+        assert (principal.username, principal.active, principal.scopes) == ("owner", False, ("task:read",))
+        assert not hasattr(principal, "email") and not hasattr(principal, "__dict__")
+        assert asyncio.run(user_crud.get_principal(db, "missing")) is None
+
+    def test_user_listing_filters_and_pages(self, db):
+        """This method test the user listing is filtered through the listing indexes and paged on username"""
+        for username, scopes, created_by, active in [("carol", ["task:read"], "admin", True), ("alice", ["task:read", "admin:user"], "script", True),
+                                                     ("bob", ["task:read"], "admin", False), ("dave", ["task:write"], "admin", True)]:
+            asyncio.run(user_crud.create(db, Users(username=username, email="email", scopes=scopes, created_by=created_by, active=active)))
+
+        page = asyncio.run(user_crud.get_all(db, user_filter(), limit=2))
+        assert [user.username for user in page] == ["alice", "bob"]
+        assert not hasattr(page[0], "hashed_password")
+        page = asyncio.run(user_crud.get_all(db, user_filter(), limit=2, after=page[-1].username))
+        assert [user.username for user in page] == ["carol", "dave"]
+
+        read = asyncio.run(user_crud.get_all(db, user_filter(scopes=["task:read"], created_by="admin")))
+        assert [user.username for user in read] == ["bob", "carol"]
+        active = asyncio.run(user_crud.get_all(db, user_filter(scopes=["task:read"], active=True)))
+        assert [user.username for user in active] == ["alice", "carol"]
+
+        asyncio.run(user_crud.remove_by_name(db, "carol"))
+        read = asyncio.run(user_crud.get_all(db, user_filter(scopes=["task:read"], created_by="admin")))
+        assert [user.username for user in read] == ["bob"]
+
+    def test_search_ranks_and_prefixes(self, db):
+        """This method test title search through the inverted index, scoped to the user"""
+        titles = ["Buy milk", "Buy oat milk and bread", "Call the bank", "Buy milk"]
+        created = [asyncio.run(task_crud.create(db, Tasks(title=title, userId="owner"))) for title in titles]
+        asyncio.run(task_crud.create(db, Tasks(title="Buy milk", userId="other")))
+
+        tasks = asyncio.run(task_crud.search(db, "owner", "milk "))
+        assert [task.id for task in tasks] == [created[0].id, created[3].id, created[1].id]
+        tasks = asyncio.run(task_crud.search(db, "owner", "buy mi"))
+        assert {task.id for task in tasks} == {created[0].id, created[1].id, created[3].id}
+        assert asyncio.run(task_crud.search(db, "owner", "buy mi", prefix=False)) == []
+        assert asyncio.run(task_crud.search(db, "owner", "ba", status=Status.DONE)) == []
+
+        asyncio.run(task_crud.update_by_id(db, created[2].id, Tasks(title="Call the plumber", status=Status.DONE)))
+        assert asyncio.run(task_crud.search(db, "owner", "bank ")) == []
+        assert [task.id for task in asyncio.run(task_crud.search(db, "owner", "plu", status=Status.DONE))] == [created[2].id]
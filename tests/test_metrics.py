@@ -0,0 +1,29 @@
+from src.metrics import Counter, Gauge, Histogram, Registry
+
+
+class TestMetrics:
+    """Test class for the Prometheus text rendering of the metrics"""
+
+    def test_counter_and_gauge(self):
+        """This method test counters and callback gauges render one line per label set"""
+        registry = Registry()
+        counter = registry.register(Counter("requests_total", "Requests", ("route",)))
+        registry.register(Gauge("queue", "Queue", ("stat",), callback=lambda: {("size",): 3}))
+        counter.inc(("/tasks",))
+        counter.inc(("/tasks",))
+        text = registry.render()
+        assert '# TYPE requests_total counter' in text
+        assert 'requests_total{route="/tasks"} 2' in text
+        assert 'queue{stat="size"} 3' in text
+
+    def test_histogram(self):
+        """This method test histogram buckets are cumulative"""
+        histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+        histogram.observe(("/tasks",), 0.05)
+        histogram.observe(("/tasks",), 0.5)
+        histogram.observe(("/tasks",), 5)
+        text = histogram.render()
+        assert 'latency_seconds_bucket{route="/tasks",le="0.1"} 1' in text
+        assert 'latency_seconds_bucket{route="/tasks",le="1.0"} 2' in text
+        assert 'latency_seconds_bucket{route="/tasks",le="+Inf"} 3' in text
+        assert 'latency_seconds_count{route="/tasks"} 3' in text
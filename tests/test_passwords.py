@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from src.database.memory import InMemoryDB, InMemoryUserCrud
+from src.models.schemas import Users
+from src.passwords import PasswordPool, PasswordPoolSaturated, get_crypt_context
+from src.routes import token
+
+PASSWORD = "PytestPassword2024"
+SCHEMES = ["sha256_crypt", "bcrypt"]
+
+
+def legacy_hash(scheme: str, rounds: int = None):
+    """hash of PASSWORD with a scheme or rounds count the pool no longer uses for new hashes"""
+    return get_crypt_context((scheme,), rounds).hash(PASSWORD)
+
+
+class TestPasswordPool:
+    """Test class for the password hashing pool, without worker processes"""
+
+    def test_saturated_pool_rejects(self):
+        """This method test hashes beyond the workers and the queue are rejected instead of queued"""
+        pool = PasswordPool(SCHEMES, 1000, workers=0, queue_size=1)
+        pool.in_flight = 2
+        with pytest.raises(PasswordPoolSaturated):
+            asyncio.run(pool.hash(PASSWORD))
+        assert pool.rejected == 1
+        pool.in_flight = 1
+        assert asyncio.run(pool.hash(PASSWORD)).startswith("$5$")
+
+    def test_saturated_pool_answers_503(self, monkeypatch):
+        """This method test a login hitting a saturated pool gets a 503 with Retry-After"""
+        pool = PasswordPool(SCHEMES, 1000, workers=0, queue_size=0)
+        pool.in_flight = 1
+        monkeypatch.setattr(token, "password_pool", pool)
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(token.verify_password(PASSWORD, legacy_hash("sha256_crypt", 1000)))
+        assert error.value.status_code == 503
+        assert error.value.headers["Retry-After"] == "1"
+
+    def test_verify_upgrades_outdated_hashes(self):
+        """This method test a hash of another scheme or rounds count verifies and gets a replacement"""
+        pool = PasswordPool(SCHEMES, 2000, workers=0, queue_size=1)
+        for outdated in (legacy_hash("bcrypt", 4), legacy_hash("sha256_crypt", 1000)):
+            verified, new_hash = asyncio.run(pool.verify_and_update(PASSWORD, outdated))
+            assert verified
+            assert new_hash.startswith("$5$rounds=2000$")
+        current = asyncio.run(pool.hash(PASSWORD))
+        assert asyncio.run(pool.verify_and_update(PASSWORD, current)) == (True, None)
+        assert asyncio.run(pool.verify_and_update("wrong", current)) == (False, None)
+
+    def test_login_stores_upgraded_hash(self, monkeypatch):
+        """This method test authenticate_user replaces an outdated stored hash through update_password"""
+        pool = PasswordPool(SCHEMES, 1000, workers=0, queue_size=1)
+        user_crud = InMemoryUserCrud()
+        monkeypatch.setattr(token, "password_pool", pool)
+        monkeypatch.setattr(token, "crud", user_crud)
+        db = InMemoryDB()
+        user = Users(username="legacy", email="email", scopes=["task:read"], hashed_password=legacy_hash("bcrypt", 4))
+        asyncio.run(user_crud.create(db, user))
+
+        asyncio.run(token.authenticate_user(db, "legacy", PASSWORD, ["task:read"]))
+        stored = asyncio.run(user_crud.get_by_name(db, "legacy")).hashed_password
+        assert stored.startswith("$5$rounds=1000$")
+        assert asyncio.run(pool.verify_and_update(PASSWORD, stored)) == (True, None)
@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+from src.singleflight import SingleFlight
+
+
+class TestSingleFlight:
+    """Test class for the coalescing of concurrent identical reads"""
+
+    def test_concurrent_calls_share_one_query(self):
+        """This method test identical concurrent lookups run the query once and all get its result"""
+        async def scenario():
+            flight = SingleFlight()
+            queries = []
+
+            async def query():
+                queries.append(1)
+                await asyncio.sleep(0.01)
+                return "task"
+
+            results = await asyncio.gather(*(flight.do("key", query) for _ in range(5)))
+            assert results == ["task"] * 5
+            assert len(queries) == 1
+            assert flight.stats() == {"calls": 5, "executed": 1, "shared": 4, "in_flight": 0}
+            await flight.do("key", query)
+            assert len(queries) == 2
+
+        asyncio.run(scenario())
+
+    def test_error_reaches_every_caller(self):
+        """This method test a failing query raises in every caller sharing it"""
+        async def scenario():
+            flight = SingleFlight()
+
+            async def query():
+                await asyncio.sleep(0.01)
+                raise ValueError("down")
+
+            results = await asyncio.gather(*(flight.do("key", query) for _ in range(3)), return_exceptions=True)
+            assert all(isinstance(result, ValueError) for result in results)
+
+        asyncio.run(scenario())
+
+    def test_cancelled_caller_leaves_query_to_others(self):
+        """This method test cancelling one caller keeps the query for the others, and the last one cancels it"""
+        async def scenario():
+            flight = SingleFlight()
+            started = asyncio.Event()
+
+            async def query():
+                started.set()
+                await asyncio.sleep(0.05)
+                return "task"
+
+            first = asyncio.create_task(flight.do("key", query))
+            second = asyncio.create_task(flight.do("key", query))
+            await started.wait()
+            first.cancel()
+            assert await second == "task"
+            with pytest.raises(asyncio.CancelledError):
+                await first
+
+            alone = asyncio.create_task(flight.do("key", query))
+            await asyncio.sleep(0.01)
+            alone.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await alone
+            assert flight.stats()["in_flight"] == 0
+
+        asyncio.run(scenario())
+
+    def test_forget_starts_a_new_query(self):
+        """This method test a read issued after a write does not join a query started before it"""
+        async def scenario():
+            flight = SingleFlight()
+            value = {"title": "before"}
+            started = asyncio.Event()
+
+            async def query():
+                title = value["title"]
+                started.set()
+                await asyncio.sleep(0.01)
+                return title
+
+            before = asyncio.create_task(flight.do("key", query))
+            await started.wait()
+            value["title"] = "after"
+            flight.forget()
+            after = asyncio.create_task(flight.do("key", query))
+            assert await before == "before"
+            assert await after == "after"
+
+        asyncio.run(scenario())
@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 import logging
 import json
@@ -5,9 +6,12 @@ from fastapi.testclient import TestClient
 from pymongo import MongoClient
 from src.app import main_app
 from src.config.config import Settings
+from src.database.connection import DbConnection, get_task_crud
+from src.models.schemas import Tasks
+from src.events import task_events
 from scripts.generate_admin_user import generate_admin_user
 from tests.mocked_data.const import ADMIN_TEST_USER_NAME,ADMIN_TEST_USER_PASSWORD,TASK_PAYLOAD
-from src.constants import DELETED_TASK_MSG
+from src.constants import DELETED_TASK_MSG, NEXT_CURSOR_HEADER
 
 app = TestClient(main_app())
 settings = Settings.get_settings()
@@ -39,7 +43,7 @@ class TestTaskAPI:
     def create_dummy_user(self, db_conn):
         """This fixture will create a admin user for testing the APIs"""
 
-        user = generate_admin_user(db=db_conn[settings.db_name],username=ADMIN_TEST_USER_NAME,password=ADMIN_TEST_USER_PASSWORD)
+        user = generate_admin_user(username=ADMIN_TEST_USER_NAME,password=ADMIN_TEST_USER_PASSWORD)
         logging.info(f"Added dummy admin user for testing APIs")
         return user
     
@@ -110,6 +114,25 @@ class TestTaskAPI:
         assert status == payload.get("status")
     
 
+    def test_get_tasks_cursor_pagination(self,create_dummy_user,token):
+        """This method test keyset pagination of tasks through the next cursor header"""
+        headers = {'Authorization': 'Bearer ' + token, "Content-Type": "application/json"}
+        app.post(f"{self.api_url}",headers=headers,data=json.dumps({**TASK_PAYLOAD, "title": "Second Pytest Task"}))
+
+        response = app.get(f"{self.api_url}",headers=headers,params={"limit": 1})
+        first_page = response.json()
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        assert len(first_page) == 1
+        assert cursor
+
+        response = app.get(f"{self.api_url}",headers=headers,params={"limit": 1, "cursor": cursor})
+        second_page = response.json()
+        assert len(second_page) == 1
+        assert second_page[0].get("_id") > first_page[0].get("_id")
+
+        response = app.get(f"{self.api_url}",headers=headers,params={"cursor": "not-a-cursor"})
+        assert response.status_code == 400
+
     def test_update_task(self,create_dummy_user,token):
         """This method test getAll tasks"""
         payload = TASK_PAYLOAD
@@ -134,6 +157,15 @@ class TestTaskAPI:
         assert status == payload.get("status")
         assert actual_res.get('contributors') == ["dummy_contributor"]
     
+    def test_write_missing_task(self,create_dummy_user,token):
+        """This method test writes to a task that does not exist answer 404"""
+        missing_id = "0123456789abcdef01234567"
+        headers = {'Authorization': 'Bearer ' + token, "Content-Type": "application/json"}
+        response = app.put(f"{self.api_url}/update/{missing_id}",headers=headers, data=json.dumps(TASK_PAYLOAD))
+        assert response.status_code == 404
+        response = app.delete(f"{self.api_url}/delete/{missing_id}",headers=headers)
+        assert response.status_code == 404
+
     def test_remove_task(self,create_dummy_user,token):
         """This method test getAll tasks"""
         payload = TASK_PAYLOAD
@@ -153,3 +185,177 @@ class TestTaskAPI:
     
 
 
+
+    def test_bulk_tasks(self,create_dummy_user,token):
+        """This method test bulk create, update and delete of tasks"""
+        headers = {'Authorization': 'Bearer ' + token, "Content-Type": "application/json"}
+        items = [{"title": "Bulk Task 1", "status": "Todo"}, {"title": " "}, {"title": "Bulk Task 2", "status": "Done"}]
+
+        response = app.post(f"{self.api_url}/bulk",headers=headers,data=json.dumps({"items": items, "ordered": False}))
+        results = response.json()["results"]
+        assert [result["status"] for result in results] == ["created", "invalid", "created"]
+        created_ids = [results[0]["id"], results[2]["id"]]
+
+        response = app.post(f"{self.api_url}/bulk",headers=headers,data=json.dumps({"items": items, "ordered": True}))
+        results = response.json()["results"]
+        assert [result["status"] for result in results] == ["created", "invalid", "skipped"]
+        created_ids.append(results[0]["id"])
+
+        updates = [{"_id": created_ids[0].upper(), "title": "Bulk Task 1", "status": "Done"}, {"_id": "0123456789abcdef01234567", "title": "Missing"}]
+        response = app.put(f"{self.api_url}/bulk/update",headers=headers,data=json.dumps({"items": updates}))
+        results = response.json()["results"]
+        assert [result["status"] for result in results] == ["updated", "not_found"]
+        assert app.get(f"{self.api_url}/{created_ids[0]}",headers=headers).json().get("status") == "Done"
+
+        response = app.delete(f"{self.api_url}/bulk/delete",headers=headers,data=json.dumps({"items": [created_ids[0].upper(), *created_ids[1:], created_ids[1]], "ordered": False}))
+        results = response.json()["results"]
+        assert [result["status"] for result in results] == ["deleted", "deleted", "deleted", "invalid"]
+        assert results[0]["id"] == created_ids[0]
+        assert app.get(f"{self.api_url}/{created_ids[0]}",headers=headers).status_code == 404
+
+    def test_export_tasks(self,create_dummy_user,token):
+        """This method test the NDJSON export of tasks"""
+        headers = {'Authorization': 'Bearer ' + token}
+        listed = app.get(f"{self.api_url}",headers=headers).json()
+        response = app.get(f"{self.api_url}/export",headers=headers)
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        exported = [json.loads(line) for line in response.text.splitlines()]
+        assert [task["_id"] for task in exported] == [task["_id"] for task in listed]
+        assert all(task["userId"] == ADMIN_TEST_USER_NAME for task in exported)
+
+    def test_get_tasks_fields(self,create_dummy_user,token):
+        """This method test reading a subset of the task fields"""
+        headers = {'Authorization': 'Bearer ' + token}
+        response = app.get(f"{self.api_url}",headers=headers,params={"fields": "title,status"})
+        tasks = response.json()
+        assert tasks
+        assert all(set(task.keys()) == {"_id", "title", "status"} for task in tasks)
+
+        response = app.get(f"{self.api_url}/{tasks[0]['_id']}",headers=headers,params={"fields": "title"})
+        assert response.json() == {"_id": tasks[0]["_id"], "title": tasks[0]["title"]}
+
+        response = app.get(f"{self.api_url}",headers=headers,params={"fields": "title,hashed_password"})
+        assert response.status_code == 422
+
+    def test_task_summary(self,create_dummy_user,token):
+        """This method test the per status summary follows task writes"""
+        headers = {'Authorization': 'Bearer ' + token, "Content-Type": "application/json"}
+        before = app.get(f"{self.api_url}/summary",headers=headers).json()
+        assert before["total"] == sum(before["status"].values())
+
+        app.post(f"{self.api_url}",headers=headers,data=json.dumps({"title": "Summary Task", "status": "Done", "contributors": ["summary_contributor"]}))
+        after = app.get(f"{self.api_url}/summary",headers=headers).json()
+        assert after["total"] == before["total"] + 1
+        assert after["status"]["Done"] == before["status"]["Done"] + 1
+        assert after["contributors"]["summary_contributor"] == 1
+
+        # a write that never went through the routes of this process, like one served by another worker
+        async def write():
+            await get_task_crud().create(DbConnection().db, Tasks(title="Other Worker Task", userId=ADMIN_TEST_USER_NAME))
+        asyncio.run(write())
+        assert app.get(f"{self.api_url}/summary",headers=headers).json()["total"] == after["total"] + 1
+
+    def test_task_etags(self,create_dummy_user,token):
+        """This method test conditional reads of tasks follow task writes"""
+        headers = {'Authorization': 'Bearer ' + token, "Content-Type": "application/json"}
+        response = app.get(f"{self.api_url}",headers=headers)
+        etag = response.headers["ETag"]
+        task_id = response.json()[0]["_id"]
+        response = app.get(f"{self.api_url}",headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+
+        task_etag = app.get(f"{self.api_url}/{task_id}",headers=headers).headers["ETag"]
+        assert task_etag != etag
+        assert app.get(f"{self.api_url}/{task_id}",headers={**headers, "If-None-Match": task_etag}).status_code == 304
+        assert app.get(f"{self.api_url}/{task_id}",headers={**headers, "If-None-Match": "*"}).status_code == 304
+        assert app.get(f"{self.api_url}/0123456789abcdef01234567",headers={**headers, "If-None-Match": "*"}).status_code == 404
+
+        app.post(f"{self.api_url}",headers=headers,data=json.dumps({**TASK_PAYLOAD, "title": "ETag Task"}))
+        response = app.get(f"{self.api_url}",headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        assert app.get(f"{self.api_url}/{task_id}",headers={**headers, "If-None-Match": task_etag}).status_code == 200
+
+    def test_shared_tasks(self,create_dummy_user,db_conn,token):
+        """This method test contributors read the tasks shared with them but can't write them"""
+        headers = {'Authorization': 'Bearer ' + token, "Content-Type": "application/json"}
+        created = app.post(f"{self.api_url}",headers=headers,data=json.dumps({"title": "Shared Task", "contributors": [ADMIN_TEST_USER_NAME]})).json()
+        # hand the task over, the current user stays a contributor
+        app.put(f"{self.api_url}/update/{created['_id']}",headers=headers,data=json.dumps({"title": "Shared Task", "userId": "pytest_owner"}))
+        try:
+            owned = app.get(f"{self.api_url}",headers=headers).json()
+            assert created["_id"] not in [task["_id"] for task in owned]
+            response = app.get(f"{self.api_url}",headers=headers,params={"view": "shared"})
+            assert response.status_code == 200
+            assert "ETag" not in response.headers
+            shared = response.json()
+            assert created["_id"] in [task["_id"] for task in shared]
+            assert {task["_id"] for task in owned} <= {task["_id"] for task in shared}
+
+            response = app.get(f"{self.api_url}/{created['_id']}",headers=headers)
+            assert response.status_code == 200
+            assert response.json()["userId"] == "pytest_owner"
+            assert "ETag" not in response.headers
+            response = app.put(f"{self.api_url}/update/{created['_id']}",headers=headers,data=json.dumps({"title": "Taken back"}))
+            assert response.status_code == 401
+        finally:
+            db_conn[settings.db_name].tasks.delete_many({"userId": "pytest_owner"})
+
+    def test_bulk_hand_over(self,create_dummy_user,db_conn,token,monkeypatch):
+        """This method test a bulk update handing a task over to another user reports and publishes it"""
+        headers = {'Authorization': 'Bearer ' + token, "Content-Type": "application/json"}
+        created = app.post(f"{self.api_url}",headers=headers,data=json.dumps({"title": "Bulk Hand Over"})).json()
+        published = []
+        async def publish(events):
+            published.extend(events)
+        monkeypatch.setattr(task_events,"publish",publish)
+        try:
+            updates = [{"_id": created["_id"], "title": "Bulk Hand Over", "userId": "pytest_owner"}]
+            results = app.put(f"{self.api_url}/bulk/update",headers=headers,data=json.dumps({"items": updates})).json()["results"]
+            assert [result["status"] for result in results] == ["updated"]
+            assert [(event.type, event.task["_id"], event.task["userId"]) for event in published] == [("updated", created["_id"], "pytest_owner")]
+            assert published[0].users == {ADMIN_TEST_USER_NAME, "pytest_owner"}
+
+            # the task is not the caller's anymore, a second hand over matches nothing
+            results = app.put(f"{self.api_url}/bulk/update",headers=headers,data=json.dumps({"items": updates})).json()["results"]
+            assert [result["status"] for result in results] == ["not_found"]
+        finally:
+            db_conn[settings.db_name].tasks.delete_many({"userId": "pytest_owner"})
+
+    def test_search_tasks(self,create_dummy_user,token):
+        """This method test searching the tasks of the current user by title prefix"""
+        headers = {'Authorization': 'Bearer ' + token, "Content-Type": "application/json"}
+        created = app.post(f"{self.api_url}",headers=headers,data=json.dumps({"title": "Searchable quarterly report"})).json()
+        response = app.get(f"{self.api_url}/search",headers=headers,params={"q": "quarter"})
+        assert response.status_code == 200
+        assert created["_id"] in [task["_id"] for task in response.json()]
+        response = app.get(f"{self.api_url}/search",headers=headers,params={"q": "quarter", "status": "Done"})
+        assert created["_id"] not in [task["_id"] for task in response.json()]
+
+    def test_search_ranks_whole_words(self,create_dummy_user,db_conn,token):
+        """This method test multi-word search through the text index, ranked by relevance and scoped to the user"""
+        headers = {'Authorization': 'Bearer ' + token, "Content-Type": "application/json"}
+        titles = ["Zephyr ledger audit for the northern region office", "Zephyr ledger audit", "Zephyr audit", "Zephyr ledger"]
+        created = [app.post(f"{self.api_url}",headers=headers,data=json.dumps({"title": title})).json() for title in titles]
+        # the last task goes to another user, its title matches best but it is not the caller's anymore
+        app.put(f"{self.api_url}/update/{created[3]['_id']}",headers=headers,data=json.dumps({"title": titles[3], "userId": "pytest_owner"}))
+        try:
+            response = app.get(f"{self.api_url}/search",headers=headers,params={"q": "zephyr ledger", "prefix": "false"})
+            assert response.status_code == 200
+            # every word must match, the shorter title is the more relevant one
+            assert [task["_id"] for task in response.json()] == [created[1]["_id"], created[0]["_id"]]
+
+            response = app.get(f"{self.api_url}/search",headers=headers,params={"q": "ledger zeph"})
+            assert [task["_id"] for task in response.json()] == [created[1]["_id"], created[0]["_id"]]
+        finally:
+            db_conn[settings.db_name].tasks.delete_many({"userId": "pytest_owner"})
+
+    def test_metrics(self,create_dummy_user,token):
+        """This method test request metrics are exposed per route template"""
+        headers = {'Authorization': 'Bearer ' + token}
+        app.get(f"{self.api_url}",headers=headers)
+        response = app.get("/metrics")
+        assert response.status_code == 200
+        assert 'http_requests_total{method="GET",route="/api/v1/tasks",status="200"}' in response.text
+        assert 'http_request_duration_seconds_bucket{method="GET",route="/api/v1/tasks",le="+Inf"}' in response.text
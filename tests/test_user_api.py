@@ -0,0 +1,71 @@
+import pytest
+import json
+from fastapi.testclient import TestClient
+from pymongo import MongoClient
+from src.app import main_app
+from src.config.config import Settings
+from scripts.generate_admin_user import generate_admin_user
+from tests.mocked_data.const import ADMIN_TEST_USER_NAME,ADMIN_TEST_USER_PASSWORD
+from src.constants import NEXT_CURSOR_HEADER
+
+app = TestClient(main_app())
+settings = Settings.get_settings()
+LISTED_USERS = ["pytest_listed_a", "pytest_listed_b"]
+
+class TestUserAPI:
+    """Test class for testing the user APIs"""
+    api_url = "/api/v1/users"
+
+    @pytest.fixture(scope='module')
+    def db_conn(self):
+        """This fixture methods establish a db connection and will be available till all tests executed"""
+
+        db_client = MongoClient(
+            host=settings.mongo_host,
+            port=settings.mongo_port,
+            username=settings.mongo_username,
+            password=settings.mongo_password
+        )
+        yield db_client
+
+        users_db = db_client[settings.db_name]
+        users_db.users.delete_many({"username":{"$in": [ADMIN_TEST_USER_NAME, *LISTED_USERS]}})
+
+        db_client.close()
+
+    @pytest.fixture
+    def token(self, db_conn):
+        """This fixture creates the admin user and generates its auth token"""
+
+        generate_admin_user(username=ADMIN_TEST_USER_NAME,password=ADMIN_TEST_USER_PASSWORD)
+        form_data = {
+            "username": ADMIN_TEST_USER_NAME,
+            "password": ADMIN_TEST_USER_PASSWORD,
+            "scope": "task:read task:write task:delete admin:user"
+        }
+        response = app.post("/api/v1/token",headers={},data=form_data)
+        return response.json()['access_token']
+
+    def test_list_users(self,token):
+        """This method test the admin listing is filtered and paged through the next cursor header"""
+        headers = {'Authorization': 'Bearer ' + token, "Content-Type": "application/json"}
+        for username in LISTED_USERS:
+            payload = {"username": username, "email": "email", "scopes": ["task:read"], "password": "PytestListedUser2024"}
+            app.post(f"{self.api_url}",headers=headers,data=json.dumps(payload))
+
+        params = {"created_by": ADMIN_TEST_USER_NAME, "scopes": "task:read", "active": "true", "limit": 1}
+        response = app.get(f"{self.api_url}",headers=headers,params=params)
+        assert response.status_code == 200
+        first_page = response.json()
+        assert [user["username"] for user in first_page] == LISTED_USERS[:1]
+        assert "hashed_password" not in first_page[0]
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        assert cursor
+
+        response = app.get(f"{self.api_url}",headers=headers,params={**params, "cursor": cursor})
+        assert [user["username"] for user in response.json()] == LISTED_USERS[1:]
+
+        response = app.get(f"{self.api_url}",headers=headers,params={"created_by": ADMIN_TEST_USER_NAME, "scopes": "admin:user"})
+        assert response.json() == []
+        response = app.get(f"{self.api_url}",headers=headers,params={"cursor": "not-a-cursor"})
+        assert response.status_code == 400